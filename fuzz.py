@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""Randomized rule fuzzing for Sokool.
+
+Plays random (and deliberately nasty) key presses through
+Player.update and the enemy AI on generated rooms, headless, checking
+after every step that:
+
+  * there's exactly one player, and it's where it thinks it is
+  * push blocks are never created or destroyed
+  * place blocks are only ever moved, picked up or eaten
+  * underfoot stacks are one non-solid entity deep
+  * every goal is still on the map
+  * the player's hp stays within bounds
+
+When something breaks, the move log is shrunk down to a minimal one
+which still breaks it the same way, and fuzzing carries on looking for
+other broken rules.
+
+Usage:
+
+  python fuzz.py [--steps N] [--seed N] [--width N] [--height N]
+                 [--ignore RULE ...]
+
+"""
+
+import argparse
+import curses
+import random
+import time
+
+import renderers
+import sokoban
+
+
+# CONFIG CONSTANTS ############################################################
+
+
+KEYS = (
+        curses.KEY_LEFT,
+        curses.KEY_UP,
+        curses.KEY_RIGHT,
+        curses.KEY_DOWN,
+        ord('a'),
+        ord('w'),
+        ord('d'),
+        ord('s'),
+       )
+
+KEY_NAMES = {
+             curses.KEY_LEFT: 'left',
+             curses.KEY_UP: 'up',
+             curses.KEY_RIGHT: 'right',
+             curses.KEY_DOWN: 'down',
+            }
+
+# (dx, dy) each key acts toward
+KEY_DIRECTIONS = {
+                  curses.KEY_LEFT: (-1, 0),
+                  curses.KEY_UP: (0, -1),
+                  curses.KEY_RIGHT: (1, 0),
+                  curses.KEY_DOWN: (0, 1),
+                  ord('a'): (-1, 0),
+                  ord('w'): (0, -1),
+                  ord('d'): (1, 0),
+                  ord('s'): (0, 1),
+                 }
+
+# moves per episode before starting over on a new room
+EPISODE_LENGTH = 200
+
+# how often an adversarial episode picks a key that interacts with
+# something over a purely random one
+ADVERSARIAL_BIAS = 0.8
+
+
+# ROOMS #######################################################################
+
+
+def generate_room(rng, width, height):
+    """A random room map, in the format of the files in rooms/.
+
+    Args:
+      rng (random.Random): where the randomness comes from.
+      width (int): columns, walls included.
+      height (int): rows, walls included.
+
+    Returns:
+      str: the room's map.
+
+    """
+
+    rows = [['#'] * width] + [['#'] + [' '] * (width - 2) + ['#']
+                              for y in range(height - 2)] + [['#'] * width]
+    interior = [(x, y) for y in range(1, height - 1)
+                for x in range(1, width - 1)]
+    rng.shuffle(interior)
+
+    push_blocks = rng.randint(1, 3)
+    counts = (
+              ('@', 1),
+              ('$', push_blocks),
+              ('.', push_blocks),
+              ('%', rng.randint(0, 4)),
+              ('&', rng.randint(0, 3)),
+              ('#', len(interior) // rng.randint(5, 10)),
+             )
+
+    for character, count in counts:
+
+        for i in range(count):
+            x, y = interior.pop()
+            rows[y][x] = character
+
+    return '\n'.join(''.join(row) for row in rows) + '\n'
+
+
+# PLAYING #####################################################################
+
+
+class Invariant(Exception):
+
+    def __init__(self, rule, detail):
+        """A game rule didn't hold.
+
+        Args:
+          rule (str): which rule, used to tell failures apart.
+          detail (str): what exactly was wrong.
+
+        """
+
+        Exception.__init__(self, '%s: %s' % (rule, detail))
+        self.rule = rule
+
+
+class WatchedRoom(sokoban.Room):
+
+    def __init__(self, room=1, file_contents=None):
+        """A Room which notes down every cell written to, so check() only
+        has to look at what changed since the last step instead of the
+        whole map.
+
+        """
+
+        sokoban.Room.__init__(self, room, file_contents)
+
+        self.touched = set()  # plots written to since the last check()
+
+        # as of the last check(): plot -> name of what was there, and
+        # how many of each entity name there were
+        self.seen = {}
+        self.names = {}
+
+    def draw(self, background=True, flush=True):
+        sokoban.Room.draw(self, background, flush)
+        self.goal_plots = frozenset(self.goals)
+
+    def __setitem__(self, key, value):
+        sokoban.Room.__setitem__(self, key, value)
+        self.touched.add(key)
+
+    def __delitem__(self, key):
+        sokoban.Room.__delitem__(self, key)
+        self.touched.add(key)
+
+
+def check(room, totals, ignore=(), everything=False):
+    """Raise Invariant if any of the rules are broken.
+
+    Only the cells written to since the last check are looked at, and
+    the entity counts are kept up to date from those.
+
+    Args:
+      room (WatchedRoom): the room being played.
+      totals (dict): push block and place block counts at the start.
+      ignore (container): rules not to raise for (known bugs).
+      everything (bool): count and look at every cell again, in case
+        something changed the map without going through the room.
+
+    """
+
+    player = sokoban.player
+
+    if (not 0 <= player.hp <= player.max_hp) and 'hp' not in ignore:
+
+        raise Invariant('hp', 'hp is %s/%s' % (player.hp, player.max_hp))
+
+    if (not 0 <= player.blocks <= player.max_blocks
+        and 'blocks' not in ignore):
+
+        raise Invariant('blocks', 'holding %s/%s'
+                                  % (player.blocks, player.max_blocks))
+
+    if everything:
+        room.seen.clear()
+        room.names.clear()
+        plots = list(room.overlay_cells)
+    else:
+        plots = room.touched
+
+    overlay_cells = room.overlay_cells
+    seen = room.seen
+    names = room.names
+    goals = room.goal_plots
+
+    # the hot path, so only what's changed
+    for plot in plots:
+        entity = overlay_cells[plot]
+        name = entity.name
+        previous = seen.get(plot)
+
+        if name != previous:
+
+            if previous is not None:
+                names[previous] -= 1
+
+            names[name] = names.get(name, 0) + 1
+            seen[plot] = name
+
+        underfoot = entity.underfoot
+
+        if (underfoot is not None
+            and (underfoot.solid or underfoot.underfoot is not None)
+            and 'underfoot' not in ignore):
+
+            raise Invariant('underfoot', '%s at %s is standing on %s'
+                                         % (name, plot, underfoot.name))
+
+        if (plot in goals and name != 'goal'
+            and (underfoot is None or underfoot.name != 'goal')
+            and 'goals' not in ignore):
+
+            raise Invariant('goals', 'goal at %s is gone, %s is there'
+                                     % (plot, name))
+
+    room.touched.clear()
+
+    if 'one player' not in ignore:
+
+        if names.get('player', 0) != 1:
+
+            raise Invariant('one player', '%d players on the map'
+                                          % names.get('player', 0))
+
+        if overlay_cells.get((player.x, player.y)) is not player:
+
+            raise Invariant('one player', 'player thinks it is at %s'
+                                          % ((player.x, player.y),))
+
+    push_blocks = names.get('push block', 0)
+
+    if push_blocks != totals['push block'] and 'push blocks' not in ignore:
+
+        raise Invariant('push blocks', '%d on the map, started with %d'
+                                       % (push_blocks,
+                                          totals['push block']))
+
+    # eating a place block is what gives xp
+    place_blocks = names.get('place block', 0) + player.blocks + player.xp
+
+    if (place_blocks != totals['place block']
+        and 'place blocks' not in ignore):
+
+        raise Invariant('place blocks', '%d accounted for, started with %d'
+                                        % (place_blocks,
+                                           totals['place block']))
+
+
+def play(contents, moves, ignore=()):
+    """Play moves from the start of a room, checking the rules as we go.
+
+    Args:
+      contents (str): the room's map.
+      moves (iterable): key codes to press. May be a generator looking
+        at sokoban.room/sokoban.player to decide each key.
+      ignore (container): rules which don't count as broken (see
+        check()). A crash of an ignored type still ends the game.
+
+    Returns:
+      tuple: (list of the keys played, Invariant or None). Crashes in
+        the game itself count as broken rules too.
+
+    """
+
+    room = sokoban.room = WatchedRoom(0, file_contents=contents)
+    room.draw()
+    player = sokoban.player = room.player
+    sokoban.status = sokoban.StatusPanel()
+    scheduler = sokoban.AIScheduler()
+
+    # the first check() counts everything, it's all just been drawn
+    check(room, {'push block': 0, 'place block': 0}, ('push blocks',
+                                                      'place blocks'))
+    totals = {
+              'push block': room.names.get('push block', 0),
+              'place block': room.names.get('place block', 0),
+             }
+
+    played = []
+
+    try:
+
+        for key in moves:
+            played.append(key)
+
+            if player.update(key):
+                scheduler.update(room)
+
+            check(room, totals, ignore)
+
+            # Player.update raises once the player's dead
+            if player.hp <= 0 or room.goals_complete():
+
+                break
+
+        # anything that went around the room's back shows up here
+        check(room, totals, ignore, everything=True)
+
+    except Invariant as failure:
+
+        return played, failure
+
+    except Exception as crash:
+        failure = Invariant(type(crash).__name__, repr(crash))
+
+        if failure.rule in ignore:
+
+            return played, None
+
+        return played, failure
+
+    return played, None
+
+
+def random_moves(rng, length):
+    """Random key presses."""
+
+    for i in range(length):
+
+        yield rng.choice(KEYS)
+
+
+def adversarial_moves(rng, length):
+    """Key presses that go looking for trouble.
+
+    Picked as the room plays out: most of the time a key which pushes,
+    places or walks into something is chosen over one that acts on
+    empty space.
+
+    """
+
+    for i in range(length):
+        player = sokoban.player
+        interesting = []
+
+        for key in KEYS:
+            step_x, step_y = KEY_DIRECTIONS[key]
+            target = sokoban.room[(player.x + step_x, player.y + step_y)]
+
+            if target.name not in ('empty', 'wall'):
+                interesting.append(key)
+
+        if interesting and rng.random() < ADVERSARIAL_BIAS:
+
+            yield rng.choice(interesting)
+
+        else:
+
+            yield rng.choice(KEYS)
+
+
+def shrink(contents, moves, rule, ignore=()):
+    """Cut moves down to a minimal log which still breaks rule.
+
+    Delta debugging: try dropping ever smaller chunks of moves, keeping
+    whatever still fails the same way.
+
+    """
+
+    def fails(candidate):
+        failure = play(contents, candidate, ignore)[1]
+
+        return failure is not None and failure.rule == rule
+
+    chunk = len(moves) // 2
+
+    while chunk:
+        i = 0
+
+        while i < len(moves):
+            candidate = moves[:i] + moves[i + chunk:]
+
+            if fails(candidate):
+                moves = candidate
+            else:
+                i += chunk
+
+        chunk //= 2
+
+    return moves
+
+
+def describe(moves):
+
+    return ' '.join(KEY_NAMES.get(key, chr(key) if key < 256 else str(key))
+                    for key in moves)
+
+
+def fuzz(steps, seed=0, width=10, height=8, ignore=()):
+    """Fuzz the rules for roughly steps moves.
+
+    Keeps going after something breaks: once a rule has been seen
+    broken it's ignored from then on, so the rest of the run goes
+    looking for different bugs instead of finding the same one again.
+
+    Args:
+      ignore (iterable): rules not to look for at all (known bugs).
+
+    Returns:
+      list: (room map, minimal moves, Invariant) for each rule that
+        broke, in the order they were found.
+
+    """
+
+    rng = random.Random(seed)
+    sokoban.renderer = renderers.NullRenderer()
+    ignore = set(ignore)
+    failures = []
+    played = 0
+    episode = 0
+    started = time.time()
+
+    while played < steps:
+        contents = generate_room(rng, width, height)
+
+        if episode % 2:
+            moves = adversarial_moves(rng, EPISODE_LENGTH)
+        else:
+            moves = random_moves(rng, EPISODE_LENGTH)
+
+        moves, failure = play(contents, moves, ignore)
+        played += len(moves)
+        episode += 1
+
+        if failure is not None:
+            moves = shrink(contents, moves, failure.rule, ignore)
+            failure = play(contents, moves, ignore)[1]
+            failures.append((contents, moves, failure))
+            ignore.add(failure.rule)
+
+    elapsed = time.time() - started
+    print('%d steps over %d rooms, %d steps/second'
+          % (played, episode, played / max(elapsed, 1e-9)))
+
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fuzz the Sokool rules.')
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--height', type=int, default=8)
+    parser.add_argument('--ignore', metavar='RULE', action='append',
+                        default=[],
+                        help='a rule not to look for, e.g. a known bug '
+                             '(repeat for more)')
+    args = parser.parse_args()
+
+    failures = fuzz(args.steps, args.seed, args.width, args.height,
+                    args.ignore)
+
+    for contents, moves, failure in failures:
+        print('broken rule: %s' % failure)
+        print(contents)
+        print('moves (%d): %s' % (len(moves), describe(moves)))
+
+    if failures:
+        raise SystemExit(1)
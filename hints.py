@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+"""Hints: what to do next, from wherever the player is right now.
+
+A HintEngine searches for a solution on a background thread while the
+game is played. Every turn the game hands it the current state; if
+that's somewhere the search has already been, the work done so far is
+kept (expanded states and their scores live in a transposition table
+across turns, and a found solution is followed for as long as the
+player sticks to it). Asking for a hint waits at most a frame's worth
+of time and gives back the best move found so far.
+
+The search plays by a model of the game's rules: pushing, picking up
+and setting down place blocks, and enemies stepping toward the player,
+hurting them on contact. A place block set down on an enemy crushes
+it before it gets the chance to eat the block (see Enemy.update).
+Enemy movement is a greedy approximation of their A*, which is plenty
+for a hint.
+
+"""
+
+import collections
+import threading
+import heapq
+import time
+import gc
+
+
+# CONFIG CONSTANTS ############################################################
+
+
+# most seconds a hint waits for the search, about a frame
+HINT_BUDGET = 1.0 / 30
+
+# hint() gives up this many seconds before its budget is out, so that
+# waking up late still gets the answer in within the frame
+HINT_SLACK = 0.005
+
+# seconds the search spends per batch, between which the game can get a
+# word in (and hint() gets the best move so far)
+BATCH_SECONDS = 0.002
+
+# memory the transposition table and the search may use (bytes)
+MAX_TABLE_BYTES = 64 * 1024 * 1024
+
+# roughly what a state costs: its tuples and sets, its successors and
+# the search's bookkeeping for it (measured on 20x8 rooms)
+STATE_BYTES = 1280
+
+# least recently used states are dropped from the table past this many
+MAX_TABLE_SIZE = MAX_TABLE_BYTES // STATE_BYTES
+
+# how much the heuristic is trusted over the moves taken so far
+HEURISTIC_WEIGHT = 2
+
+DIRECTIONS = (
+              ('left', (-1, 0)),
+              ('up', (0, -1)),
+              ('right', (1, 0)),
+              ('down', (0, 1)),
+             )
+
+
+# MODEL #######################################################################
+
+
+# where a state's parts are in its tuple. States are nothing but
+# tuples (the blocks and enemies are sorted tuples of plots, not
+# sets), which the garbage collector learns to leave alone; a table
+# full of sets has it pausing everything for tens of milliseconds.
+PLAYER, PUSH_BLOCKS, PLACE_BLOCKS, ENEMIES, HELD, HP = range(6)
+
+
+class Level(object):
+
+    def __init__(self, coordinates, walls, goals, max_blocks):
+        """The parts of a room which never change while it's played.
+
+        Args:
+          coordinates (set): every (x, y) on the map.
+          walls (set): (x, y) of the walls.
+          goals (iterable): (x, y) of the goals.
+          max_blocks (int): most place blocks the player can hold.
+
+        """
+
+        self.coordinates = frozenset(coordinates)
+        self.walls = frozenset(walls)
+        self.goals = frozenset(goals)
+        self.max_blocks = max_blocks
+
+        # a push block in one of these can never be got out again
+        self.dead_corners = set()
+
+        for x, y in self.coordinates - self.walls - self.goals:
+            blocked = [(x + dx, y + dy) in self.walls
+                       or (x + dx, y + dy) not in self.coordinates
+                       for name, (dx, dy) in DIRECTIONS]
+
+            # two walls at right angles
+            if any(blocked[i] and blocked[(i + 1) % 4] for i in range(4)):
+                self.dead_corners.add((x, y))
+
+    def open(self, plot):
+        """True if plot is on the map and isn't a wall."""
+
+        return plot in self.coordinates and plot not in self.walls
+
+
+def level_of(room, player):
+    """The Level of a room which has been drawn.
+
+    Args:
+      room (sokoban.Room): the room.
+      player (sokoban.Player): the player in it.
+
+    """
+
+    walls = [plot for plot, entity in room.overlay_cells.items()
+             if entity.name == 'wall']
+
+    return Level(room.coordinates, walls, room.goals, player.max_blocks)
+
+
+def state_of(room, player):
+    """Where everything which can change in a room is, as a hashable
+    tuple (see PLAYER, PUSH_BLOCKS, ...).
+
+    """
+
+    push_blocks = []
+    place_blocks = []
+    enemies = []
+
+    for plot, entity in room.overlay_cells.items():
+
+        if entity.name == 'push block':
+            push_blocks.append(plot)
+        elif entity.name == 'place block':
+            place_blocks.append(plot)
+        elif entity.name == 'enemy':
+            enemies.append(plot)
+
+    return ((player.x, player.y), tuple(sorted(push_blocks)),
+            tuple(sorted(place_blocks)), tuple(sorted(enemies)),
+            player.blocks, player.hp)
+
+
+def swap(plots, out=None, into=None):
+    """plots (a sorted tuple) with out taken out and into put in."""
+
+    return tuple(sorted([plot for plot in plots if plot != out]
+                        + ([into] if into is not None else [])))
+
+
+def move_enemies(level, player, push_blocks, place_blocks, enemies, hp):
+    """Each enemy takes a step toward the player, like Enemy.update.
+
+    Returns:
+      tuple: (enemies, hp) afterwards.
+
+    """
+
+    moved = set(enemies)
+
+    for enemy in enemies:
+        x, y = enemy
+        steps = []
+
+        if player[0] != x:
+            steps.append((x + (1 if player[0] > x else -1), y))
+
+        if player[1] != y:
+            steps.append((x, y + (1 if player[1] > y else -1)))
+
+        for step in steps:
+
+            if step == player:
+                # enemies spend themselves hurting the player
+                hp -= 1
+                moved.discard(enemy)
+
+                break
+
+            if (level.open(step) and step not in push_blocks
+                and step not in place_blocks and step not in moved):
+
+                moved.discard(enemy)
+                moved.add(step)
+
+                break
+
+    return tuple(sorted(moved)), hp
+
+
+def successors(level, state):
+    """Every (action, pushes, next state) one key press away from state.
+
+    action is a direction name for moves and 'place <direction>' for
+    setting a place block; pushes is True if the move pushes a block.
+    States the player dies in are left out.
+
+    """
+
+    player, push_blocks, place_blocks, enemies, held, hp = state
+    results = []
+
+    for name, (dx, dy) in DIRECTIONS:
+        target = (player[0] + dx, player[1] + dy)
+
+        if not level.open(target):
+
+            continue
+
+        # set a place block, only when it's any use: to get in an
+        # enemy's way (on one crushes it before it can eat the block)
+        # or with full hands, to pick up another one which is in the
+        # way of a push. Anywhere else only makes the search bigger.
+        # Setting one on a goal would wipe the goal out, so never there.
+        if (held and target not in push_blocks
+            and target not in place_blocks and target not in level.goals
+            and (held == level.max_blocks
+                 or any(abs(enemy[0] - target[0])
+                        + abs(enemy[1] - target[1]) <= 1
+                        for enemy in enemies))):
+
+            next_enemies = tuple(enemy for enemy in enemies
+                                 if enemy != target)
+            next_place_blocks = swap(place_blocks, into=target)
+            next_enemies, next_hp = move_enemies(level, player, push_blocks,
+                                                 next_place_blocks,
+                                                 next_enemies, hp)
+
+            if next_hp > 0:
+                results.append(('place ' + name, False,
+                                (player, push_blocks, next_place_blocks,
+                                 next_enemies, held - 1, next_hp)))
+
+        # walk, pick up or push
+        if target in enemies:
+
+            continue
+
+        next_push_blocks = push_blocks
+        next_place_blocks = place_blocks
+        next_held = held
+        pushes = False
+
+        if target in place_blocks:
+
+            if held == level.max_blocks:
+
+                continue
+
+            next_place_blocks = swap(place_blocks, out=target)
+            next_held += 1
+
+        elif target in push_blocks:
+            beyond = (target[0] + dx, target[1] + dy)
+
+            if (not level.open(beyond) or beyond in push_blocks
+                or beyond in place_blocks or beyond in enemies
+                or beyond in level.dead_corners):
+
+                continue
+
+            next_push_blocks = swap(push_blocks, target, beyond)
+            pushes = True
+
+        next_enemies, next_hp = move_enemies(level, target, next_push_blocks,
+                                             next_place_blocks, enemies, hp)
+
+        if next_hp > 0:
+            results.append((name, pushes,
+                            (target, next_push_blocks, next_place_blocks,
+                             next_enemies, next_held, next_hp)))
+
+    return tuple(results)
+
+
+def heuristic(level, state):
+    """Estimated key presses left: every push block's distance to the
+    nearest goal, plus the walk to the nearest block not on one.
+
+    """
+
+    player, push_blocks = state[PLAYER], state[PUSH_BLOCKS]
+    estimate = 0
+    nearest = None
+
+    for block in push_blocks:
+
+        if block in level.goals:
+
+            continue
+
+        estimate += min(abs(block[0] - goal[0]) + abs(block[1] - goal[1])
+                        for goal in level.goals)
+        walk = abs(block[0] - player[0]) + abs(block[1] - player[1]) - 1
+
+        if nearest is None or walk < nearest:
+            nearest = walk
+
+    return estimate + (nearest or 0)
+
+
+def solved(level, state):
+
+    return all(goal in state[PUSH_BLOCKS] for goal in level.goals)
+
+
+# SEARCH ######################################################################
+
+
+def keep_collector_off():
+    """Keep the garbage collector from walking everything made so far.
+
+    The search makes hundreds of thousands of tuples, none of which
+    ever need collecting (they're freed as soon as they're dropped),
+    but a full collection still walks every one of them, stalling every
+    thread for tens of milliseconds. gc.freeze() puts them out of its
+    reach; without it (before Python 3.7) the collector is just
+    switched off until let_collector_back().
+
+    """
+
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    else:
+        gc.disable()
+
+
+def let_collector_back():
+    """Undo keep_collector_off(), once what it made has been dropped."""
+
+    if hasattr(gc, 'unfreeze'):
+        gc.unfreeze()
+    else:
+        gc.enable()
+
+
+class HintEngine(object):
+
+    def __init__(self, budget=HINT_BUDGET):
+        """Anytime weighted A* for hints, on a background thread.
+
+        Call update() with the state every turn and hint() whenever the
+        player asks; start() gets the thread going.
+
+        Args:
+          budget (float): most seconds hint() waits for the search.
+
+        """
+
+        self.budget = budget
+        self.level = None
+        self.root = None
+
+        # state -> (heuristic, successors), kept across turns, least
+        # recently used first
+        self.table = collections.OrderedDict()
+
+        # the search from the current root, only ever touched by the
+        # worker thread
+        self.openset = []
+        self.g_score = {}
+        self.came_from = {}  # state -> (previous state, action, pushes)
+        self.best = None  # (heuristic, moves, state) of the best so far
+        self.done = True
+        self.counter = 0
+
+        # the solution found (see path_to()), kept for as long as the
+        # player keeps following it
+        self.plan = None
+
+        # the game hands states over through here and never waits on
+        # the worker: only the latest (level, state) is kept
+        self.pending = collections.deque(maxlen=1)
+        self.latest = None
+        self.wake = threading.Event()
+
+        # (root, next move, done) of the search, swapped in whole after
+        # every batch so hint() can read it without waiting either
+        self.answer = (None, None, True)
+        self.published = threading.Event()
+
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop searching, waiting out the batch in progress (see
+        BATCH_SECONDS).
+
+        """
+
+        self.running = False
+        self.wake.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def update(self, level, state):
+        """The game moved on to state; search from there instead.
+
+        Only hands the state to the worker, so it never holds up a
+        turn.
+
+        Args:
+          level (Level): the room being played. Passing a different
+            one (a new room) starts the transposition table over.
+          state (tuple): see state_of().
+
+        """
+
+        self.latest = state
+        self.pending.append((level, state))
+        self.wake.set()
+
+    def restart(self, level, state):
+        """Search from state, keeping whatever still applies."""
+
+        if level is not self.level:
+            self.level = level
+            self.table = collections.OrderedDict()
+            self.openset = []
+            self.g_score = {}
+            self.came_from = {}
+            self.plan = None
+
+            # the old room's search is gone, so whatever else was kept
+            # out of the collector's way can be collected again
+            let_collector_back()
+
+        if state == self.root:
+
+            return
+
+        self.root = state
+
+        # still following the plan? then there's nothing to search
+        if self.plan:
+            states = [step[0] for step in self.plan]
+
+            if state in states:
+                self.plan = self.plan[states.index(state):]
+                self.done = True
+
+                return
+
+            self.plan = None
+
+        self.openset = [(0, 0, state)]
+        self.g_score = {state: 0}
+        self.came_from = {}
+        self.best = None
+        self.done = solved(level, state)
+
+    def expand(self, state):
+        """(heuristic, successors) of state, from the table if we've
+        been here before.
+
+        """
+
+        entry = self.table.pop(state, None)
+
+        if entry is None:
+            entry = (heuristic(self.level, state),
+                     successors(self.level, state))
+
+            while len(self.table) >= MAX_TABLE_SIZE:
+                self.table.popitem(last=False)
+
+        self.table[state] = entry
+
+        return entry
+
+    def search(self, seconds=BATCH_SECONDS):
+        """Expand states for about seconds (at least one)."""
+
+        deadline = time.time() + seconds
+
+        while True:
+
+            if not self.openset:
+                self.done = True
+
+                return
+
+            # too big to finish, settle for the best so far
+            if len(self.g_score) > MAX_TABLE_SIZE:
+                self.done = True
+
+                return
+
+            f_score, counter, current = heapq.heappop(self.openset)
+            current_h, current_successors = self.expand(current)
+            current_g = self.g_score[current]
+
+            if current != self.root and (self.best is None
+                                         or (current_h, current_g)
+                                         < self.best[:2]):
+                self.best = (current_h, current_g, current)
+
+            if solved(self.level, current):
+                self.plan = self.path_to(current)
+                self.done = True
+
+                return
+
+            for action, pushes, neighbor in current_successors:
+                tentative_g_score = current_g + 1
+
+                if tentative_g_score < self.g_score.get(neighbor,
+                                                        float('inf')):
+                    self.g_score[neighbor] = tentative_g_score
+                    self.came_from[neighbor] = (current, action, pushes)
+                    self.counter += 1
+                    neighbor_h = self.expand(neighbor)[0]
+                    heapq.heappush(self.openset,
+                                   (tentative_g_score
+                                    + HEURISTIC_WEIGHT * neighbor_h,
+                                    self.counter, neighbor))
+
+            if time.time() >= deadline:
+
+                return
+
+    def path_to(self, state):
+        """The moves from the root to state, as [(state before, action,
+        pushes), ...].
+
+        """
+
+        path = []
+
+        while state in self.came_from:
+            previous, action, pushes = self.came_from[state]
+            path.append((previous, action, pushes))
+            state = previous
+
+        path.reverse()
+
+        return path
+
+    def publish(self):
+        """Swap in the next move from the root, as far as we know."""
+
+        if self.plan:
+            move = self.plan[0][1:]
+        elif self.best is not None:
+            move = self.path_to(self.best[2])[0][1:]
+        else:
+            move = None
+
+        self.answer = (self.root, move, self.done)
+        self.published.set()
+
+    def run(self):
+
+        while self.running:
+            self.wake.clear()
+
+            try:
+                level, state = self.pending.pop()
+
+            except IndexError:
+                pass
+
+            else:
+                self.restart(level, state)
+                self.publish()
+
+            if self.done:
+                self.wake.wait()
+
+                continue
+
+            self.search()
+            keep_collector_off()
+            self.publish()
+
+            # give the game the interpreter between batches
+            time.sleep(0)
+
+        let_collector_back()
+
+    def hint(self, budget=None):
+        """The next move toward solving the room from where the player
+        is, as (action, pushes), or None if there isn't one yet.
+
+        Waits up to budget seconds (the engine's budget by default, less
+        HINT_SLACK) for the search to finish, then settles for the best
+        found so far.
+
+        """
+
+        budget = self.budget if budget is None else budget
+        deadline = time.time() + budget - HINT_SLACK
+
+        while True:
+            self.published.clear()
+            root, move, done = self.answer
+            current = root == self.latest
+            remaining = deadline - time.time()
+
+            # another batch wouldn't be in before the deadline, and
+            # waiting on it anyway wakes us up late
+            if (current and done) or remaining < BATCH_SECONDS:
+
+                return move if current else None
+
+            self.published.wait(remaining)
+
+
+def describe(hint):
+    """Human readable hint, for the status panel."""
+
+    if hint is None:
+
+        return 'no idea!'
+
+    action, pushes = hint
+
+    return ('push ' if pushes else '') + action
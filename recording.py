@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""Session recording and playback for Sokool.
+
+Sessions are written as asciicast v2 (https://asciinema.org), so a
+recording can be shared and played with the stock asciinema tools, or
+streamed through a pipe to a local spectator running this module.
+
+Only cells which changed during a turn are written out. Every so often
+a keyframe (a full redraw of the screen) is written too, which is what
+lets the player seek without replaying the whole session.
+
+Usage:
+
+  python recording.py session.cast [--start SECONDS] [--speed N]
+  python recording.py session.fifo --follow
+
+"""
+
+import curses
+import json
+import stat
+import time
+import sys
+import os
+
+
+# CONFIG CONSTANTS ############################################################
+
+
+# a full frame is written every this many turns, so seeking never
+# needs to replay more than this many deltas
+KEYFRAME_INTERVAL = 50
+
+# recordings are written through a buffer this size (in bytes), so a
+# turn never waits on the disk or the spectator on the other end
+WRITE_BUFFER_SIZE = 64 * 1024
+
+KEYFRAME_MARKER = 'keyframe'
+
+# escape sequences
+RESET = '\x1b[0m'
+CLEAR = '\x1b[2J'
+
+
+# ANSI ENCODING ###############################################################
+
+
+def cursor_to(y, x):
+    """Escape sequence moving the cursor to row y, column x (0-based)."""
+
+    return '\x1b[%d;%dH' % (y + 1, x + 1)
+
+
+def sgr(style, palette):
+    """Escape sequence selecting a cell style.
+
+    Args:
+      style (tuple): (color_pair, attr) where attr is a curses attribute.
+      palette (dict): curses color pair # -> (foreground, background).
+        The eight basic curses colors share their numbering with ANSI.
+
+    """
+
+    color_pair, attr = style
+    codes = ['0']
+
+    if attr & curses.A_BOLD:
+        codes.append('1')
+
+    if attr & curses.A_REVERSE:
+        codes.append('7')
+
+    if color_pair in palette:
+        foreground, background = palette[color_pair]
+        codes.append('3%d' % foreground)
+        codes.append('4%d' % background)
+
+    return '\x1b[%sm' % ';'.join(codes)
+
+
+def encode_cells(cells, palette, style=None):
+    """Turn changed cells into as few escape sequences as possible.
+
+    Cells are written row by row. Runs of neighbouring cells only pay
+    for one cursor movement, and the style is only re-sent when it
+    actually changes.
+
+    Args:
+      cells (dict): (y, x) -> (character, (color_pair, attr)).
+      palette (dict): see sgr().
+      style (tuple): the style the terminal is already in, if known.
+
+    Returns:
+      tuple: (escape sequence string, style the terminal is left in).
+
+    """
+
+    output = []
+    cursor = None
+
+    for y, x in sorted(cells):
+        character, cell_style = cells[(y, x)]
+
+        if cursor != (y, x):
+            output.append(cursor_to(y, x))
+
+        if cell_style != style:
+            output.append(sgr(cell_style, palette))
+            style = cell_style
+
+        output.append(character)
+        cursor = (y, x + 1)
+
+    return ''.join(output), style
+
+
+class CellBuffer(object):
+
+    def __init__(self, height, width):
+        """A screen's worth of cells, and which of them changed since
+        they were last written out. Recorder and the ANSI renderer both
+        draw into one, so they clip and diff the same way.
+
+        Args:
+          height (int): rows; anything put below is dropped.
+          width (int): columns; anything put past is dropped.
+
+        """
+
+        self.height = height
+        self.width = width
+
+        # back is what's been put, front is what was last written out
+        self.back = {}
+        self.front = {}
+        self.dirty = set()
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+        """Put text starting at row y, column x, in a curses color pair
+        and attributes.
+
+        """
+
+        if not 0 <= y < self.height:
+
+            return
+
+        style = (color_pair, attr)
+
+        for i, character in enumerate(text):
+
+            if not 0 <= x + i < self.width:
+
+                continue
+
+            self.back[(y, x + i)] = (character, style)
+            self.dirty.add((y, x + i))
+
+    def changes(self):
+        """Cells put since the last call which differ from what was
+        written out then, as (y, x) -> (character, style). They count as
+        written out from now on.
+
+        """
+
+        changed = {}
+
+        for plot in self.dirty:
+            cell = self.back[plot]
+
+            if self.front.get(plot) != cell:
+                changed[plot] = cell
+                self.front[plot] = cell
+
+        self.dirty.clear()
+
+        return changed
+
+    def everything(self):
+        """Every cell put so far, for a full redraw. They all count as
+        written out from now on.
+
+        """
+
+        self.front = dict(self.back)
+        self.dirty.clear()
+
+        return self.back
+
+
+# RECORDING ###################################################################
+
+
+class Recorder(object):
+
+    def __init__(self, target, width, height, palette=None,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        """Writes the screen out as an asciicast v2 delta stream.
+
+        The game mirrors its screen writes here with put(), then calls
+        end_turn() once the turn's done. Only cells that differ from
+        what was last written end up in the recording.
+
+        Args:
+          target (str|file): path (file or named pipe) to write to, or
+            an already open file object.
+          width (int): terminal columns.
+          height (int): terminal rows.
+          palette (dict): curses color pair # -> (foreground, background).
+          keyframe_interval (int): turns between full-frame keyframes.
+
+        """
+
+        if hasattr(target, 'write'):
+            self.stream = target
+            self.owns_stream = False
+            self.live = False
+        else:
+            self.stream = open(target, 'w', WRITE_BUFFER_SIZE)
+            self.owns_stream = True
+
+            # somebody is spectating on the other end of a pipe, so
+            # hand them each turn as it happens
+            self.live = stat.S_ISFIFO(os.stat(target).st_mode)
+
+        self.width = width
+        self.height = height
+        self.palette = palette or {}
+        self.keyframe_interval = keyframe_interval
+
+        self.cells = CellBuffer(height, width)
+        self.style = None
+
+        self.turns = 0
+        self.started = time.time()
+
+        header = {
+                  'version': 2,
+                  'width': width,
+                  'height': height,
+                  'timestamp': int(self.started),
+                  'env': {'TERM': 'xterm-256color'},
+                 }
+        self.stream.write(json.dumps(header) + '\n')
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+        """Mirror a screen write of text starting at row y, column x."""
+
+        self.cells.put(y, x, text, color_pair, attr)
+
+    def end_turn(self):
+        """Write out everything that changed since the last turn."""
+
+        elapsed = time.time() - self.started
+
+        keyframe = self.turns % self.keyframe_interval == 0
+
+        if keyframe:
+            self.write_event(elapsed, 'm', KEYFRAME_MARKER)
+            output, self.style = encode_cells(self.cells.everything(),
+                                              self.palette)
+            output = RESET + CLEAR + output
+
+        else:
+            output, self.style = encode_cells(self.cells.changes(),
+                                              self.palette, self.style)
+
+        self.turns += 1
+
+        if output:
+            self.write_event(elapsed, 'o', output)
+
+        # keyframes also bound how much a crash can lose
+        if self.live or keyframe:
+            self.stream.flush()
+
+    def write_event(self, elapsed, event_type, data):
+        self.stream.write(json.dumps([round(elapsed, 6), event_type, data])
+                          + '\n')
+
+    def close(self):
+        self.stream.flush()
+
+        if self.owns_stream:
+            self.stream.close()
+
+
+# PLAYBACK ####################################################################
+
+
+class Playback(object):
+
+    def __init__(self, source):
+        """A recorded session, indexed by keyframe for seeking.
+
+        Args:
+          source (str|file): path or open file of an asciicast v2
+            recording.
+
+        """
+
+        if hasattr(source, 'read'):
+            lines = source.read().splitlines()
+        else:
+
+            with open(source) as f:
+                lines = f.read().splitlines()
+
+        self.header = json.loads(lines[0])
+        self.events = []  # (time, output) of every output event
+        self.keyframes = []  # indexes into self.events
+
+        keyframe_next = False
+
+        for line in lines[1:]:
+
+            if not line.strip():
+
+                continue
+
+            elapsed, event_type, data = json.loads(line)
+
+            if event_type == 'm' and data == KEYFRAME_MARKER:
+                keyframe_next = True
+
+            elif event_type == 'o':
+
+                if keyframe_next:
+                    self.keyframes.append(len(self.events))
+                    keyframe_next = False
+
+                self.events.append((elapsed, data))
+
+        self.duration = self.events[-1][0] if self.events else 0
+
+    def index_at(self, seconds):
+        """Index of the last event at or before seconds."""
+
+        index = -1
+
+        for i, event in enumerate(self.events):
+
+            if event[0] > seconds:
+
+                break
+
+            index = i
+
+        return index
+
+    def seek(self, seconds):
+        """The output which recreates the screen as it was at seconds.
+
+        Starts from the last keyframe at or before seconds, so only
+        the deltas since that keyframe get replayed.
+
+        """
+
+        index = self.index_at(seconds)
+        keyframe = 0
+
+        for candidate in self.keyframes:
+
+            if candidate > index:
+
+                break
+
+            keyframe = candidate
+
+        return ''.join(data for elapsed, data
+                       in self.events[keyframe:index + 1])
+
+    def play(self, stream=None, start=0, speed=1.0):
+        """Play the session to stream (stdout by default) in real time.
+
+        Args:
+          stream (file): where to write the terminal output.
+          start (float): seconds into the recording to seek to first.
+          speed (float): playback speed multiplier.
+
+        """
+
+        stream = stream or sys.stdout
+        stream.write(self.seek(start))
+        stream.flush()
+
+        index = self.index_at(start)
+        previous = start
+
+        for elapsed, data in self.events[index + 1:]:
+            time.sleep(max(0, elapsed - previous) / speed)
+            previous = elapsed
+            stream.write(data)
+            stream.flush()
+
+        stream.write(RESET + '\n')
+
+
+def follow(source, stream=None):
+    """Spectate a session while it's being recorded, e.g. from a pipe.
+
+    Args:
+      source (str): path of the recording or named pipe.
+      stream (file): where to write the terminal output.
+
+    """
+
+    stream = stream or sys.stdout
+
+    with open(source) as f:
+        f.readline()  # header
+
+        for line in iter(f.readline, ''):
+
+            if not line.strip():
+
+                continue
+
+            elapsed, event_type, data = json.loads(line)
+
+            if event_type == 'o':
+                stream.write(data)
+                stream.flush()
+
+    stream.write(RESET + '\n')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Play a recorded Sokool '
+                                                 'session.')
+    parser.add_argument('recording', help='asciicast v2 file or pipe')
+    parser.add_argument('--start', type=float, default=0,
+                        help='seconds into the recording to start from')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed multiplier')
+    parser.add_argument('--follow', action='store_true',
+                        help='spectate a session as it is recorded')
+    args = parser.parse_args()
+
+    if args.follow:
+        follow(args.recording)
+    else:
+        Playback(args.recording).play(start=args.start, speed=args.speed)
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""Screen backends for Sokool.
+
+The game only ever talks to a Renderer: it puts text at screen
+coordinates, flushes once a turn and asks for keys. Two backends:
+
+  CursesRenderer: the original curses screen.
+  AnsiRenderer: keeps a front/back buffer of cells (a
+    recording.CellBuffer, like the Recorder's) and, on flush, writes
+    only what changed as ANSI escape sequences in one write.
+    Writing to a file (or anything which isn't a terminal) makes it
+    headless.
+
+NullRenderer draws nothing, for tools which only want the game rules.
+
+Usage:
+
+  python renderers.py [--frames N]
+
+benchmarks the backends against each other.
+
+"""
+
+import curses
+import random
+import time
+import sys
+import os
+
+import recording
+
+
+# CONFIG CONSTANTS ############################################################
+
+
+# used when the size of the output can't be found out (headless)
+DEFAULT_SIZE = (24, 80)
+
+# escape sequences
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+
+ARROW_KEYS = {
+              'A': curses.KEY_UP,
+              'B': curses.KEY_DOWN,
+              'C': curses.KEY_RIGHT,
+              'D': curses.KEY_LEFT,
+             }
+
+
+def terminal_size(stream):
+    """(rows, columns) of the terminal stream is attached to, if any."""
+
+    try:
+
+        columns, rows = os.get_terminal_size(stream.fileno())
+
+        return rows, columns
+
+    except (AttributeError, ValueError, OSError):
+
+        return DEFAULT_SIZE
+
+
+def outline(put, y, x, height, width, title=None):
+    """Draw an ascii box through put(y, x, text, color_pair, attr).
+
+    Args:
+      put (callable): a Renderer.put() or anything like it.
+      title (str): written into the top edge, if given.
+
+    """
+
+    put(y, x, '+' + '-' * (width - 2) + '+')
+
+    for row in range(y + 1, y + height - 1):
+        put(row, x, '|')
+        put(row, x + width - 1, '|')
+
+    put(y + height - 1, x, '+' + '-' * (width - 2) + '+')
+
+    if title:
+        put(y, x + 2, ' ' + title + ' ', attr=curses.A_REVERSE)
+
+
+# BACKENDS ####################################################################
+
+
+class Renderer(object):
+
+    # True if it's worth flushing mid-draw for animation
+    animated = False
+
+    def size(self):
+        """(rows, columns) of the screen."""
+
+        raise NotImplementedError
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+        """Write text starting at row y, column x. Anything off the
+        screen is dropped.
+
+        Args:
+          y (int): screen row.
+          x (int): screen column.
+          text (str): what to write.
+          color_pair (int): curses color pair # to write it in.
+          attr (int): any other curses attributes (A_BOLD, A_REVERSE).
+
+        """
+
+        raise NotImplementedError
+
+    def clear(self, y, x, height, width, color_pair=0):
+        """Blank out a rectangle of the screen."""
+
+        for row in range(y, y + height):
+            self.put(row, x, ' ' * width, color_pair)
+
+    def box(self, y, x, height, width, title=None):
+        """Outline a rectangle, with an optional title in the top edge."""
+
+        outline(self.put, y, x, height, width, title)
+
+    def flush(self):
+        """Get everything put so far onto the screen."""
+
+        raise NotImplementedError
+
+    def getch(self):
+        """Block for a key press. Returns a curses key code."""
+
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CursesRenderer(Renderer):
+
+    animated = True
+
+    def __init__(self, palette):
+        """Draws on the curses standard screen.
+
+        Args:
+          palette (dict): curses color pair # -> (foreground, background).
+
+        """
+
+        self.screen = curses.initscr()
+
+        # nobody gets the chance to close() us if this goes wrong, so
+        # give the terminal back here (some terminals can't hide the
+        # cursor, or don't have enough colors)
+        try:
+            curses.noecho()
+            curses.curs_set(0)
+            curses.start_color()
+            curses.use_default_colors()
+            curses.cbreak()
+            self.screen.keypad(1)
+
+            for color_pair, colors in palette.items():
+                curses.init_pair(color_pair, *colors)
+
+        except curses.error:
+            curses.endwin()
+
+            raise
+
+    def size(self):
+
+        return self.screen.getmaxyx()
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+
+        try:
+            self.screen.addstr(y, x, text, curses.color_pair(color_pair)
+                                           | attr)
+
+        # curses complains about writing off (or right up to) the edge
+        except curses.error:
+            pass
+
+    def box(self, y, x, height, width, title=None):
+        window = self.screen.derwin(height, width, y, x)
+        window.box()
+
+        if title:
+            window.addstr(0, 2, ' ' + title + ' ', curses.A_REVERSE)
+
+    def flush(self):
+        self.screen.refresh()
+
+    def getch(self):
+
+        return self.screen.getch()
+
+    def close(self):
+        curses.endwin()
+
+
+class AnsiRenderer(Renderer):
+
+    def __init__(self, palette, output=None, keys=None, size=None):
+        """Writes ANSI escape sequences, only for cells which changed.
+
+        Args:
+          palette (dict): curses color pair # -> (foreground, background).
+          output (file): where to write, stdout by default. If it isn't
+            a terminal, nothing is animated (headless).
+          keys (file): where key presses come from, stdin by default.
+          size (tuple): (rows, columns), else the terminal's size.
+
+        """
+
+        self.palette = palette
+        self.output = output or sys.stdout
+        self.keys = keys or sys.stdin
+        self.height, self.width = size or terminal_size(self.output)
+        self.animated = self.output.isatty()
+
+        self.cells = recording.CellBuffer(self.height, self.width)
+        self.style = None
+
+        # key presses come a byte at a time, not a line at a time
+        self.terminal_settings = None
+
+        if self.keys.isatty():
+            import termios
+            import tty
+
+            self.terminal_settings = termios.tcgetattr(self.keys)
+            tty.setcbreak(self.keys.fileno())
+
+        self.output.write(recording.RESET + recording.CLEAR + HIDE_CURSOR)
+
+    def size(self):
+
+        return self.height, self.width
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+        self.cells.put(y, x, text, color_pair, attr)
+
+    def flush(self):
+        changed = self.cells.changes()
+
+        if not changed:
+
+            return
+
+        output, self.style = recording.encode_cells(changed, self.palette,
+                                                    self.style)
+        self.output.write(output)
+        self.output.flush()
+
+    def getch(self):
+        character = self.keys.read(1)
+
+        if not character:
+
+            raise EOFError('out of key presses')
+
+        if character != '\x1b':
+
+            return ord(character)
+
+        # arrow keys come through as ESC [ A..D
+        sequence = self.keys.read(2)
+
+        if len(sequence) == 2 and sequence[1] in ARROW_KEYS:
+
+            return ARROW_KEYS[sequence[1]]
+
+        return 27
+
+    def close(self):
+        self.output.write(recording.RESET + SHOW_CURSOR + '\n')
+        self.output.flush()
+
+        if self.terminal_settings is not None:
+            import termios
+
+            termios.tcsetattr(self.keys, termios.TCSADRAIN,
+                              self.terminal_settings)
+
+
+class NullRenderer(Renderer):
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """Draws nothing at all, for running the game as fast as it'll
+        go (see fuzz.py). Key presses are handed to Player.update.
+
+        """
+
+        self.height, self.width = size
+
+    def size(self):
+
+        return self.height, self.width
+
+    def put(self, y, x, text, color_pair=0, attr=0):
+        pass
+
+    def clear(self, y, x, height, width, color_pair=0):
+        pass
+
+    def box(self, y, x, height, width, title=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def getch(self):
+
+        raise EOFError('no keyboard')
+
+
+# BENCHMARK ###################################################################
+
+
+def benchmark(renderer, frames=1000, seed=0):
+    """Time drawing turn-like frames through a renderer.
+
+    Each frame redraws a room-sized patch the way a turn does (a few
+    entities move) and every 50th frame redraws the whole screen, like
+    a room change.
+
+    Returns:
+      float: seconds per frame.
+
+    """
+
+    rng = random.Random(seed)
+    height, width = renderer.size()
+    characters = '#$%&@. '
+
+    started = time.time()
+
+    for frame in range(frames):
+
+        if frame % 50 == 0:
+
+            for y in range(height):
+                row = ''.join(rng.choice(characters) for x in range(width))
+                renderer.put(y, 0, row[:width - 1], rng.randint(1, 7))
+
+        else:
+
+            for i in range(6):
+                renderer.put(rng.randrange(height), rng.randrange(width - 1),
+                             rng.choice(characters), rng.randint(1, 7))
+
+        renderer.flush()
+
+    return (time.time() - started) / frames
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the Sokool '
+                                                 'renderers.')
+    parser.add_argument('--frames', type=int, default=1000)
+    args = parser.parse_args()
+
+    palette = dict((i + 1, (i % 8, (i + 1) % 8)) for i in range(7))
+    results = []
+
+    with open(os.devnull, 'w') as devnull:
+        ansi = AnsiRenderer(palette, output=devnull, keys=devnull,
+                            size=terminal_size(sys.stdout))
+        results.append(('ansi (to %s)' % os.devnull,
+                        benchmark(ansi, args.frames)))
+        ansi.close()
+
+    if sys.stdout.isatty():
+        ansi = AnsiRenderer(palette)
+        results.append(('ansi (to terminal)', benchmark(ansi, args.frames)))
+        ansi.close()
+
+        screen = CursesRenderer(palette)
+        results.append(('curses', benchmark(screen, args.frames)))
+        screen.close()
+
+    for name, seconds in results:
+        print('%-20s %8.1f us/frame' % (name, seconds * 1e6))
@@ -12,16 +12,24 @@ Work on color next, all entities should have a color...
 
 """
 
-import curses, curses.panel
+import curses
+import collections
 import itertools
+import threading
 import textwrap
+import tempfile
 import random
-import glob
+import heapq
+import json
 import time
 import math
 import sys
 import os
 
+import renderers
+import recording
+import hints
+
 
 # CONFIG CONSTANTS ############################################################
 
@@ -31,8 +39,73 @@ BACKGROUND_COLOR = curses.COLOR_WHITE
 FOREGROUND_COLOR = curses.COLOR_BLACK
 PLAYER_CHARACTER = '@'
 
+# asks the hints.HintEngine what to do next
+HINT_KEY = ord('h')
+
 STATUS_PANEL_WIDTH = 35
 
+# names of the room entities which nothing can path through
+IMPASSABLE = ('wall', 'place block', 'push block')
+
+# rooms with at least this many tiles path hierarchically (see
+# ClusterMap), cut into clusters this many tiles across
+HPA_MIN_ROOM_AREA = 64 * 64
+HPA_CLUSTER_SIZE = 16
+
+# how many recently loaded rooms RoomLoader keeps around
+ROOM_CACHE_SIZE = 4
+
+# the open world (--world) is paged in chunks this many tiles square,
+# keeping those within this many chunks of the player's paged in, and
+# no more than this many chunks at once (see World)
+WORLD_CHUNK_SIZE = 16
+WORLD_CHUNK_RADIUS = 2
+WORLD_MAX_CHUNKS = 36
+
+# how many rooms' maps the open world keeps parsed, for paging in
+WORLD_ROOM_CACHE_SIZE = 16
+
+# where rooms, their backgrounds and their stories are found, and where
+# the index of them all is cached (see load_manifest()). Next to this
+# file, wherever it's run from.
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_DIRECTORIES = ('rooms', 'backgrounds', 'story')
+MANIFEST_PATH = os.path.join(DATA_DIRECTORY, '.manifest.json')
+
+# color pairs 1 through this many are used, see make_palette()
+COLOR_PAIRS = 7
+
+# (name, max steps from the player, turns between updates) for each
+# distance bucket of enemies, see AIScheduler
+AI_UPDATE_BUCKETS = (
+                     ('near', 8, 1),
+                     ('mid', 24, 2),
+                     ('far', None, 4),
+                    )
+
+# the renderers.Renderer everything is drawn through
+renderer = None
+
+# the hints.HintEngine searching the room being played, if any
+hint_engine = None
+
+# set to a recording.Recorder when the session is being recorded
+recorder = None
+
+# set to a RoomLoader once the screen size is known, see main()
+loader = None
+
+# the AIScheduler deciding which enemies think each turn, see main()
+scheduler = None
+
+# room # -> where its files are, see get_manifest()
+manifest = None
+
+# the game in progress, see main()
+room = None
+player = None
+status = None
+
 
 # A* ALGORITHM/PATH GENERATION ################################################
 
@@ -48,6 +121,12 @@ def distance(plot_a, plot_b):
     return math.sqrt(x * x + y * y)
 
 
+def manhattan_distance(plot_a, plot_b):
+    """Number of orthogonal steps between two coordinates."""
+
+    return abs(plot_a[0] - plot_b[0]) + abs(plot_a[1] - plot_b[1])
+
+
 def heuristic_cost_estimate(start, goal):
     """Traversing cost estimator for the A* algorithm."""
 
@@ -127,7 +206,7 @@ def astar(start, goal):
             # needs to reference tile_type's impassable value
             entity = room[neighbor]
 
-            if entity.name in ('wall', 'place block', 'push block'):
+            if entity.name in IMPASSABLE:
                 closedset.add(neighbor)
 
                 continue
@@ -151,24 +230,347 @@ def astar(start, goal):
     return None
 
 
-def make_panel(width, height, position, title=None):
-    """I need to document this better..."""
+class ClusterMap(object):
+
+    def __init__(self, room, size=HPA_CLUSTER_SIZE):
+        """Hierarchical (HPA*) pathfinding graph over a big room.
+
+        The room is cut into size x size clusters. Wherever two
+        neighbouring clusters can be walked between, the middle of
+        each open stretch of their border becomes an entrance, and the
+        walking distance between every pair of entrances within a
+        cluster is worked out up front. Paths are then found over
+        entrances, which is far fewer nodes than the room has tiles.
+
+        Args:
+          room (Room): drawn room to path through.
+          size (int): width/height of a cluster in tiles.
+
+        """
+
+        self.room = room
+        self.size = size
+        self.clusters = set(self.cluster_of(plot)
+                            for plot in room.coordinates)
+
+        self.borders = {}  # (cluster, cluster) -> [(plot, plot), ...]
+        self.partners = {}  # entrance -> entrances across borders
+        self.edges = {}  # cluster -> {entrance: {entrance: steps}}
+        self.dirty = set()  # clusters whose passability changed
+
+        for cluster in self.clusters:
+            cluster_x, cluster_y = cluster
+
+            for neighbor in ((cluster_x + 1, cluster_y),
+                             (cluster_x, cluster_y + 1)):
+
+                if neighbor in self.clusters:
+                    self.build_border(cluster, neighbor)
+
+        for cluster in self.clusters:
+            self.build_edges(cluster)
+
+    def cluster_of(self, plot):
+
+        return (plot[0] // self.size, plot[1] // self.size)
+
+    def passable(self, plot):
+
+        return (plot in self.room.coordinates
+                and self.room[plot].name not in IMPASSABLE)
+
+    def borders_of(self, cluster):
+        """Keys of self.borders which cluster is on either side of."""
+
+        cluster_x, cluster_y = cluster
+        candidates = (
+                      (cluster, (cluster_x + 1, cluster_y)),
+                      (cluster, (cluster_x, cluster_y + 1)),
+                      ((cluster_x - 1, cluster_y), cluster),
+                      ((cluster_x, cluster_y - 1), cluster),
+                     )
+
+        return [border for border in candidates
+                if border[0] in self.clusters and border[1] in self.clusters]
+
+    def entrances(self, cluster):
+        entrances = set()
+
+        for border in self.borders_of(cluster):
+            side = 0 if border[0] == cluster else 1
+
+            for pair in self.borders.get(border, ()):
+                entrances.add(pair[side])
+
+        return entrances
+
+    def build_border(self, cluster, neighbor):
+        """Find the entrances between cluster and the one right of/below it.
+
+        Returns:
+          bool: True if the entrances changed.
+
+        """
+
+        if neighbor[0] > cluster[0]:
+            # neighbor is to the right, walk down the shared edge
+            x = neighbor[0] * self.size
+            edge = [((x - 1, y), (x, y)) for y in
+                    range(cluster[1] * self.size,
+                          (cluster[1] + 1) * self.size)]
+
+        else:
+            # neighbor is below, walk along the shared edge
+            y = neighbor[1] * self.size
+            edge = [((x, y - 1), (x, y)) for x in
+                    range(cluster[0] * self.size,
+                          (cluster[0] + 1) * self.size)]
+
+        # the middle of each unbroken run of open pairs is an entrance
+        pairs = []
+        run = []
+
+        for pair in edge + [None]:
+
+            if pair is not None and all(self.passable(p) for p in pair):
+                run.append(pair)
+
+                continue
+
+            if run:
+                pairs.append(run[len(run) // 2])
+                run = []
+
+        border = (cluster, neighbor)
+        old_pairs = self.borders.get(border, [])
+
+        if pairs == old_pairs:
+
+            return False
+
+        for plot_a, plot_b in old_pairs:
+            self.partners[plot_a].discard(plot_b)
+            self.partners[plot_b].discard(plot_a)
+
+        for plot_a, plot_b in pairs:
+            self.partners.setdefault(plot_a, set()).add(plot_b)
+            self.partners.setdefault(plot_b, set()).add(plot_a)
+
+        self.borders[border] = pairs
+
+        return True
+
+    def build_edges(self, cluster):
+        """Work out the steps between every pair of cluster's entrances."""
+
+        entrances = self.entrances(cluster)
+        edges = {}
+
+        for entrance in entrances:
+            steps = self.search_cluster(entrance)[0]
+            edges[entrance] = dict((other, steps[other])
+                                   for other in entrances
+                                   if other != entrance and other in steps)
+
+        self.edges[cluster] = edges
+
+    def search_cluster(self, start):
+        """Breadth first search from start which never leaves its cluster.
+
+        Returns:
+          tuple: (plot -> steps from start, plot -> previous plot).
+
+        """
+
+        cluster = self.cluster_of(start)
+        steps = {start: 0}
+        came_from = {}
+        frontier = collections.deque([start])
+
+        while frontier:
+            current = frontier.popleft()
+            current_x, current_y = current
+
+            for neighbor in ((current_x - 1, current_y),
+                             (current_x, current_y - 1),
+                             (current_x, current_y + 1),
+                             (current_x + 1, current_y)):
+
+                if (neighbor in steps
+                    or self.cluster_of(neighbor) != cluster
+                    or not self.passable(neighbor)):
+
+                    continue
+
+                steps[neighbor] = steps[current] + 1
+                came_from[neighbor] = current
+                frontier.append(neighbor)
+
+        return steps, came_from
+
+    def invalidate(self, plot):
+        """Passability of plot changed; its cluster needs rebuilding."""
+
+        self.dirty.add(self.cluster_of(plot))
+
+    def refresh(self):
+        """Rebuild the dirty clusters, plus any neighbor sharing a border
+        whose entrances moved.
+
+        """
+
+        stale = set(self.dirty)
+
+        for cluster in self.dirty:
+
+            for border in self.borders_of(cluster):
+
+                if self.build_border(*border):
+                    stale.update(border)
+
+        for cluster in stale:
+            self.build_edges(cluster)
+
+        self.dirty.clear()
+
+    def first_leg(self, start, goal):
+        """Path from start to goal, only refined as far as the first
+        entrance along the way (Enemy.update only ever takes one step).
+
+        Args:
+          start (tuple): (x, y) coord to start navigating from.
+          goal (tuple): (x, y) coord to find a path to.
+
+        Returns:
+          tuple: coordinates to traverse toward goal, ending at goal if
+            it's in start's cluster, else at the first entrance on the
+            way. None if there's no way to goal.
+
+        """
+
+        if self.dirty:
+            self.refresh()
+
+        start_steps, start_came_from = self.search_cluster(start)
+
+        if goal in start_steps:
+
+            return reconstruct_path(start_came_from, goal)
+
+        goal_steps = self.search_cluster(goal)[0]
+        goal_cluster = self.cluster_of(goal)
+        start_cluster = self.cluster_of(start)
+
+        # A* over the entrances
+        came_from = {}
+        g_score = {start: 0}
+        openset = [(heuristic_cost_estimate(start, goal), start)]
+        closedset = set()
+
+        while openset:
+            current = heapq.heappop(openset)[1]
+
+            if current == goal:
+
+                break
+
+            if current in closedset:
+
+                continue
+
+            closedset.add(current)
+
+            if current == start:
+                neighbors = dict((entrance, start_steps[entrance])
+                                 for entrance in self.entrances(start_cluster)
+                                 if entrance in start_steps)
+            else:
+                neighbors = dict(self.edges[self.cluster_of(current)]
+                                    .get(current, {}))
+
+            for partner in self.partners.get(current, ()):
+                neighbors[partner] = 1
+
+            if self.cluster_of(current) == goal_cluster \
+               and current in goal_steps:
+                neighbors[goal] = goal_steps[current]
+
+            for neighbor, steps in neighbors.items():
+                tentative_g_score = g_score[current] + steps
+
+                if tentative_g_score < g_score.get(neighbor, float('inf')):
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    f_score = (tentative_g_score
+                               + heuristic_cost_estimate(neighbor, goal))
+                    heapq.heappush(openset, (f_score, neighbor))
+
+        else:
+
+            return None
+
+        # walk back to the first entrance after start, then refine
+        # just that stretch into tiles
+        first = goal
+
+        while came_from[first] != start:
+            first = came_from[first]
+
+        if first in start_steps:
+
+            return reconstruct_path(start_came_from, first)
+
+        return (start, first)
 
-    win = curses.newwin(height, width, *position)
-    win.erase()
 
-    if title:
-        win.box()
-        title = ' ' + title + ' '
-        win.addstr(0, 2, title, curses.A_REVERSE)
+# UI ##########################################################################
 
-    panel = curses.panel.new_panel(win)
 
-    return win, panel
+def put(y, x, text, color_pair=0, attr=0):
+    """Write to the screen, and to the session recording if there is one.
+
+    Args:
+      y (int): screen row the write starts on.
+      x (int): screen column the write starts on.
+      text (str): what to write.
+      color_pair (int): curses color pair # to write it in.
+      attr (int): any other curses attributes to write it with.
+
+    """
+
+    renderer.put(y, x, text, color_pair, attr)
+
+    if recorder is not None:
+        recorder.put(y, x, text, color_pair, attr)
+
+
+def clear(y, x, height, width, color_pair=0):
+    """Blank out a rectangle of the screen, and of the recording."""
+
+    renderer.clear(y, x, height, width, color_pair)
+
+    if recorder is not None:
+
+        for row in range(y, y + height):
+            recorder.put(row, x, ' ' * width, color_pair)
+
+
+def box(y, x, height, width, title=None):
+    """Outline a rectangle on the screen, and in the recording.
+
+    The recording always gets an ascii outline, whatever the renderer
+    draws it with.
+
+    """
+
+    renderer.box(y, x, height, width, title)
+
+    if recorder is not None:
+        renderers.outline(recorder.put, y, x, height, width, title)
 
 
 def menu(rows):
-    """Mostly a placeholder. Should use make_panel..."""
+    """Mostly a placeholder. Should go through the renderer..."""
 
     stats =  curses.newwin(6, 18)
     stats.box()
@@ -294,8 +696,17 @@ class Player(RoomEntity):
         status.update()
         #screen.refresh()
 
-    def update(self):
-        key = screen.getch()
+    def update(self, key=None):
+        """Handle a key press, reading one if key isn't given.
+
+        Returns:
+          bool: True if the player used up their turn.
+
+        """
+
+        if key is None:
+            key = renderer.getch()
+
         x = self.x
         y = self.y
 
@@ -340,6 +751,11 @@ class Player(RoomEntity):
 
             return self.set_block('down')
 
+        elif key == HINT_KEY and hint_engine:
+            status.show_hint(hints.describe(hint_engine.hint()))
+
+            return False
+
         else:
 
             return False
@@ -399,7 +815,15 @@ class Player(RoomEntity):
 
 class Enemy(RoomEntity):
 
-    def __init__(self):
+    def __init__(self, serial=0):
+        """Chases the player down.
+
+        Args:
+          serial (int): spawn order within its room, which keeps
+            AIScheduler deterministic (see Room.enemy_serials).
+
+        """
+
         RoomEntity.__init__(
                             self,
                             name='enemy',
@@ -412,9 +836,97 @@ class Enemy(RoomEntity):
         # the enemy only moves once the player has
         self.player_last_move_count = 0
 
-    def update(self):
+        self.serial = serial
+
+        # the last path found to the player, see find_path()
+        self.path = None
+        self.path_start = None
+        self.path_goal = None
+        self.path_version = None
+
+    def find_path(self, goal, drift=1):
+        """Path from this enemy to goal, reusing the last one if possible.
+
+        The last path stays good for as long as the room's passability
+        doesn't change (see Room.version). If the goal has only moved
+        by a tile since, the path is repaired instead of searched again.
+        If it has moved further, but no more than drift tiles from where
+        the path ends, the old path is followed as it is; enemies which
+        only think every few turns would otherwise never reuse one.
+
+        Args:
+          goal (tuple): (x, y) coord to find a path to.
+          drift (int): how far goal may be from the end of the last
+            path for it to still be followed.
+
+        Returns:
+          tuple: coordinates to traverse to get to goal, or None if
+            there's no way there.
+
+        """
+
+        start = (self.x, self.y)
+        path = self.path
+        path_goal = goal
+        reusable = (self.path_version == room.version
+                    and self.path_goal is not None
+                    and manhattan_distance(self.path_goal, goal) <= drift)
+
+        if reusable and path is None:
+            # nothing's been opened up, so wherever the goal got to
+            # it's still walled off
+            reusable = start == self.path_start
+
+        elif reusable:
+
+            # we've most likely taken the first step since
+            if start in path[:2]:
+                path = path[path.index(start):]
+
+                if goal in path:
+                    path = path[:path.index(goal) + 1]
+
+                elif path[-1] == self.path_goal:
+
+                    if manhattan_distance(path[-1], goal) == 1:
+                        path = path + (goal,)
+                    else:
+                        # head for where the goal was, it's close enough
+                        path_goal = self.path_goal
+
+                # we've walked all of an old path, or the whole first
+                # leg of a hierarchical one (see ClusterMap.first_leg)
+                if len(path) < 2:
+                    reusable = False
+
+            else:
+                reusable = False
+
+        if reusable:
+            room.path_cache_hits += 1
+        else:
+            room.path_cache_misses += 1
+            path_goal = goal
+
+            if room.cluster_map:
+                path = room.cluster_map.first_leg(start, goal)
+            else:
+                path = astar(start, goal)
+
+        self.path = path
+        self.path_goal = path_goal
+        self.path_start = start
+        self.path_version = room.version
+
+        return path
+
+    def update(self, drift=1):
         """Handle rendering enemy's interaction with the world.
 
+        Args:
+          drift (int): see find_path(), about how many turns it's been
+            since this enemy last thought.
+
         """
 
         current_plot = (self.x, self.y)
@@ -426,7 +938,7 @@ class Enemy(RoomEntity):
             return None
 
         # for moving toward the player using a*
-        astar_path = astar(current_plot, (player.x, player.y))
+        astar_path = self.find_path((player.x, player.y), drift)
 
         # enemy doesn't move if there is no path to player,
         # also enemy's sprite changes
@@ -479,6 +991,75 @@ class Enemy(RoomEntity):
         room.move(current_plot, new_plot)
 
 
+class AIScheduler(object):
+
+    def __init__(self, buckets=AI_UPDATE_BUCKETS):
+        """Decides which enemies think on which turn.
+
+        Enemies are bucketed by how many steps they are from the
+        player; near ones update every turn, far ones only every few
+        turns. Which turn an enemy gets is fixed by its serial and how
+        many turns its room has had, so a room always plays out the
+        same way for the same moves (replays match), whatever came
+        before it.
+
+        Args:
+          buckets (tuple): (name, max distance, turns between updates)
+            for each bucket, nearest first. A max distance of None
+            catches everything further out.
+
+        """
+
+        self.buckets = buckets
+
+        # per bucket: updates run, updates skipped, seconds spent
+        self.stats = dict((name, {'updates': 0, 'skips': 0, 'seconds': 0.0})
+                          for name, limit, interval in buckets)
+
+    def bucket(self, enemy):
+        steps = manhattan_distance((enemy.x, enemy.y), (player.x, player.y))
+
+        for bucket in self.buckets:
+            name, limit, interval = bucket
+
+            if limit is None or steps <= limit:
+
+                return bucket
+
+        return self.buckets[-1]
+
+    def update(self, room):
+        """Update the enemies that are due this turn."""
+
+        # snapshot, because enemies move around in the room as they
+        # update, and sort so the order never depends on dict order
+        enemies = sorted((entity for entity in room
+                          if entity.name == 'enemy'),
+                         key=lambda enemy: enemy.serial)
+
+        for enemy in enemies:
+
+            # it may have been crushed or done in since the snapshot
+            if room.overlay_cells.get((enemy.x, enemy.y)) is not enemy:
+
+                continue
+
+            name, limit, interval = self.bucket(enemy)
+            stats = self.stats[name]
+
+            if (room.turn + enemy.serial) % interval:
+                stats['skips'] += 1
+
+                continue
+
+            started = time.time()
+            enemy.update(interval)
+            stats['seconds'] += time.time() - started
+            stats['updates'] += 1
+
+        room.turn += 1
+
+
 class PlaceBlock(RoomEntity):
 
     def __init__(self):
@@ -549,7 +1130,7 @@ class StatusPanel(object):
         """Sits to the right of the game screen. Displays
         general level and player data.
 
-        Right-aligned. IS a curses panel.
+        Right-aligned.
 
         Args:
           room (int): room # to fetch meta and dialog for.
@@ -557,134 +1138,418 @@ class StatusPanel(object):
         """
 
         self.title = room.title
+        self.hint = None
 
         # screen
-        self.max_screen_y, self.max_screen_x = screen.getmaxyx()
+        self.max_screen_y, self.max_screen_x = renderer.size()
         position = (0, self.max_screen_x - STATUS_PANEL_WIDTH)
         width = STATUS_PANEL_WIDTH
         self.width = width
+        self.position = position
 
         # draw the status panel...
-        self.window, self.curses_panel = make_panel(self.width,
-                                                    self.max_screen_y,
-                                                    position, self.title)
+        clear(position[0], position[1], self.max_screen_y, width)
+        box(position[0], position[1], self.max_screen_y, width, self.title)
 
         # draw the story for this room if possible
-        if os.path.exists('story/%s.txt' % room.room):
-            story_position = 0
-            story = curses.newpad(20, width)
-            story.box()
-            story.addstr(0, 2, ' EVENT LOG ', curses.A_REVERSE)
+        if room.story:
+            story_y = self.max_screen_y - 20
+            clear(story_y, position[1], 20, width)
+            box(story_y, position[1], 20, width, 'EVENT LOG')
 
-            with open('story/%s.txt' % room.room) as f:
-                story_contents = f.readlines()
+            # whatever doesn't fit in the box is cut off
+            for y, line in enumerate(room.story[:20 - 3]):
+                put(story_y + y + 2, position[1] + 2, line)
 
-            paragraphs = []
+        self.update()
 
-            for i, paragraph in enumerate(story_contents):
+    def update(self):
+        lines = (
+                 'STEPS: %s' % player.steps,
+                 'HP: %s/%s' % (player.hp, player.max_hp),
+                 'BLOCKS: %s/%s' % (player.blocks, player.max_blocks),
+                 'XP: %s' % player.xp,
+                 'HINT: %s' % self.hint if self.hint else '',
+                )
+
+        for y, line in enumerate(lines):
+            put(self.position[0] + y + 2, self.position[1] + 2,
+                line.ljust(self.width - 4))
+
+    def show_hint(self, hint):
+        """Show hint (None to take the last one away)."""
+
+        self.hint = hint
+        self.update()
+        renderer.flush()
 
-                if paragraph == '\n':
-                    paragraphs.append(' ')
 
-                    continue
+def data_path(path):
+    """Where a path in the manifest (relative to DATA_DIRECTORY) is."""
 
-                paragraph = textwrap.wrap(paragraph,
-                                          STATUS_PANEL_WIDTH - 4)
+    return os.path.join(DATA_DIRECTORY, path)
 
-                if i == 0:
-                    paragraph[0] = paragraph[0].upper()
 
-                paragraphs.extend(paragraph)
+def build_manifest():
+    """Scan rooms/, backgrounds/ and story/ for what each room # has.
 
-            for y, line in enumerate(paragraphs):
-                story.addstr(y + 2, 2, line)
+    Returns:
+      dict: room # -> {'filename': map file, 'title': room title,
+        'background': background file or None, 'story': story file or
+        None}. Files are relative to DATA_DIRECTORY (see data_path()).
 
-        self.story_position = 0
-        self.story_pad = story
-        self.update()
+    """
 
-    def update(self):
-        self.window.addstr(2, 2, 'STEPS: %s' % player.steps)
-        self.window.addstr(3, 2, 'HP: %s/%s' % (player.hp, player.max_hp))
-        self.window.addstr(4, 2, 'BLOCKS: %s/%s' % (player.blocks,
-                                                    player.max_blocks))
-        self.window.addstr(5, 2, 'XP: %s' % player.xp)
-
-        # refresh the screen
-        curses.panel.update_panels()
-        y_position = self.max_screen_y - 20
-        x_position = self.max_screen_x - self.width
-        self.story_pad.refresh(self.story_position, 0, y_position, x_position,
-                               y_position + y_position,
-                               x_position + (self.width - 1))
-        screen.refresh()
+    listings = {}
 
+    for directory in MANIFEST_DIRECTORIES:
+        path = data_path(directory)
+        listings[directory] = (set(os.listdir(path))
+                               if os.path.isdir(path) else set())
 
-class Room(object):
+    manifest = {}
 
-    def __init__(self, room=1):
-        """Need better way of storing objects at positions in the map?
+    for name in listings['rooms']:
+        number = name.split(' - ', 1)[0]
 
-        All objects can have __str__...
+        if not (number.isdigit() and name.endswith('.txt')):
 
-        room.entities[(x, y)] to store/get entities. Just use a hash
-        table!
+            continue
 
-        """
+        filename = 'rooms/' + name
+        extras = {}
 
-        # generate model from file
-        self.room = room
-        self.filename = glob.glob('rooms/%s - *.txt' % self.room)[0]
-        self.title = self.filename.rsplit('.', 1)[0].replace('rooms/', '')
+        for directory in ('backgrounds', 'story'):
+            extra = '%s.txt' % number
+            extras[directory] = (directory + '/' + extra
+                                 if extra in listings[directory] else None)
 
-        with open(self.filename) as f:
-            file_contents = f.read()
+        manifest[int(number)] = {
+                                 'filename': filename,
+                                 'title': filename.rsplit('.', 1)[0]
+                                                  .replace('rooms/', ''),
+                                 'background': extras['backgrounds'],
+                                 'story': extras['story'],
+                                }
 
-        # static_map is for containing characters within cells [y][x]
-        self.static_map = [list(row) for row in file_contents.split('\n')][:-1]
+    return manifest
 
-        # extrapolate room meta
-        self.y = len(self.static_map) + 1
-        self.x = max([len(s) for s in self.static_map])
-        self.coordinates = []
-        self.goals = []  # so we may quickly check goal status later...
 
-        # for window/curses control
-        #self.win = curses.newwin(self.y, self.x, 0, 0)
-        self.height, self.width = screen.getmaxyx()
-        self.width -= STATUS_PANEL_WIDTH
-        self.win = curses.newwin(self.height, self.width, 0, 0)
+def load_manifest(path=MANIFEST_PATH):
+    """The room manifest, from the cache at path if it's still good.
 
-        # need a get_background command...
-        self.win.bkgd(' ', curses.color_pair(1))
-        self.background_lines = []
+    The cache is good for as long as none of the directories it was
+    built from have changed (files added, removed or renamed). If it's
+    stale it's rebuilt and saved again, if the disk lets us.
 
-        if os.path.exists('backgrounds/%s.txt' % self.room):
+    """
 
-            with open('backgrounds/%s.txt' % self.room) as f:
-                background_lines = f.readlines()
+    stamp = [os.path.getmtime(data_path(directory))
+             for directory in MANIFEST_DIRECTORIES
+             if os.path.isdir(data_path(directory))]
 
-            width = len(background_lines[0])
-            height = len(background_lines)
-            self.background_x_repeat = int(math.ceil(float(self.width)
-                                                     / float(width)))
-            self.background_y_repeat = int(math.ceil(float(self.height)
-                                           / float(height)))
+    try:
 
-            for i in xrange(self.background_y_repeat):
+        with open(path) as f:
+            cached = json.load(f)
 
-                for line in background_lines:
-                    line = line * self.background_x_repeat
-                    self.background_lines.append(line)
+        if cached['stamp'] == stamp:
 
-        # good place for items that move about, rendered last (highest z index)
-        self.overlay_cells = {}
+            return dict((int(room), entry)
+                        for room, entry in cached['rooms'].items())
 
-    def next(self):
-        self.__init__(room=self.room)
-        self.draw()
-        room.win.touchwin()
-        player = room.player
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    manifest = build_manifest()
+
+    try:
+
+        with open(path, 'w') as f:
+            json.dump({'stamp': stamp, 'rooms': manifest}, f)
+
+    except (IOError, OSError):
+        pass
+
+    return manifest
+
+
+def get_manifest():
+    """The room manifest, loaded the first time it's needed."""
+
+    global manifest
+
+    if manifest is None:
+        manifest = load_manifest()
+
+    return manifest
+
+
+class RoomData(object):
+
+    def __init__(self, room, size, file_contents=None):
+        """Everything about a room that comes off the disk, parsed and
+        ready to draw: the map, the tiled background and the wrapped
+        story. This is the slow part of changing rooms, which is why
+        RoomLoader builds these ahead of time.
+
+        Shared by every Room made from it, so never modified.
+
+        Args:
+          room (int): room # to load (see load_manifest()).
+          size (tuple): (rows, columns) of the screen it'll be drawn on.
+          file_contents (str): the room's map, to use instead of loading
+            it from rooms/ (e.g. generated rooms).
+
+        """
+
+        self.room = room
+
+        # rooms made up on the spot never go near the disk
+        if file_contents is None:
+            entry = get_manifest()[room]
+            self.filename = data_path(entry['filename'])
+            self.title = entry['title']
+
+            with open(self.filename) as f:
+                file_contents = f.read()
+
+        else:
+            entry = {}
+            self.filename = None
+            self.title = '%s - generated' % room
+
+        # static_map is for containing characters within cells [y][x]
+        self.static_map = [list(row) for row in file_contents.split('\n')][:-1]
+
+        # the room gets the screen, less the status panel
+        height, width = size
+        width -= STATUS_PANEL_WIDTH
+
+        # tile the background out to fill the room, cut to fit
+        self.background_lines = []
+
+        if entry.get('background'):
+
+            with open(data_path(entry['background'])) as f:
+                background_lines = [line.strip().replace('\n', '')
+                                    for line in f.readlines()]
+
+            x_repeat = int(math.ceil(float(width) / len(background_lines[0])))
+
+            while len(self.background_lines) < height:
+
+                for line in background_lines:
+                    line = (line * x_repeat)[:width]
+                    self.background_lines.append(line)
+
+            self.background_lines = self.background_lines[:height]
+
+        # wrap the story for the status panel
+        self.story = None
+
+        if entry.get('story'):
+
+            with open(data_path(entry['story'])) as f:
+                story_contents = f.readlines()
+
+            self.story = []
+
+            for i, paragraph in enumerate(story_contents):
+
+                if paragraph == '\n':
+                    self.story.append(' ')
+
+                    continue
+
+                paragraph = textwrap.wrap(paragraph,
+                                          STATUS_PANEL_WIDTH - 4)
+
+                if i == 0:
+                    paragraph[0] = paragraph[0].upper()
+
+                self.story.extend(paragraph)
+
+
+class RoomLoader(object):
+
+    def __init__(self, size, cache_size=ROOM_CACHE_SIZE):
+        """Loads RoomData ahead of time and keeps the recent ones.
+
+        prefetch() loads a room on a worker thread while the current
+        one is being played, so going to the next room never waits on
+        the disk. The last few rooms loaded are kept (least recently
+        used are dropped first), so going back to one is instant too.
+
+        Args:
+          size (tuple): (rows, columns) of the screen.
+          cache_size (int): how many rooms to keep.
+
+        """
+
+        self.size = size
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # room # -> RoomData
+        self.loading = {}  # room # -> worker thread
+        self.errors = {}  # room # -> exception a worker hit
+        self.lock = threading.Lock()
+
+    def load(self, room):
+
+        try:
+            data = RoomData(room, self.size)
+
+        except Exception as error:
+
+            with self.lock:
+                self.errors[room] = error
+
+            return
+
+        with self.lock:
+            self.store(room, data)
+
+    def store(self, room, data):
+        """Put data at the most recently used end (needs self.lock)."""
+
+        self.cache.pop(room, None)
+        self.cache[room] = data
+
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def prefetch(self, room):
+        """Start loading room in the background, if it isn't already."""
+
+        with self.lock:
+
+            if room in self.cache or room in self.loading:
+
+                return
+
+            worker = threading.Thread(target=self.load, args=(room,))
+            worker.daemon = True
+            self.loading[room] = worker
+
+        worker.start()
+
+    def get(self, room):
+        """RoomData for room; waits for it if it's still being prefetched.
+
+        Raises whatever loading it raised (e.g. KeyError if there's no
+        such room).
+
+        """
+
+        with self.lock:
+            worker = self.loading.pop(room, None)
+
+        if worker is not None:
+            worker.join()
+
+        with self.lock:
+
+            if room in self.errors:
+
+                raise self.errors.pop(room)
+
+            if room in self.cache:
+                data = self.cache[room]
+                self.store(room, data)
+
+                return data
+
+        data = RoomData(room, self.size)
+
+        with self.lock:
+            self.store(room, data)
+
+        return data
+
+
+class Room(object):
+
+    def __init__(self, room=1, file_contents=None):
+        """Need better way of storing objects at positions in the map?
+
+        All objects can have __str__...
+
+        room.entities[(x, y)] to store/get entities. Just use a hash
+        table!
+
+        Args:
+          room (int): room # to load from rooms/.
+          file_contents (str): the room's map, to use instead of loading
+            it from rooms/ (e.g. generated rooms).
+
+        """
+
+        # the parsed room comes from the loader, which has usually
+        # read it off the disk already
+        if file_contents is None and loader is not None:
+            data = loader.get(room)
+        else:
+            data = RoomData(room, renderer.size(), file_contents)
+
+        self.setup(room, data.title, data.static_map, data.filename,
+                   data.background_lines, data.story)
+
+    def setup(self, room, title, static_map=(), filename=None,
+              background_lines=(), story=None):
+        """Everything a room starts out with, however its map is come by
+        (a RoomData for a Room, the room files bit by bit for a World).
+
+        Args:
+          room (int): room #, if it's a single room.
+          title (str): for the status panel.
+          static_map (list): rows of map characters, see RoomData.
+          filename (str): where the map came from, if anywhere.
+          background_lines (list): the tiled background, see RoomData.
+          story (list): wrapped lines of story, if there is any.
+
+        """
+
+        self.room = room
+        self.filename = filename
+        self.title = title
+        self.static_map = static_map
+        self.background_lines = background_lines
+        self.story = story
+
+        # extrapolate room meta
+        self.y = len(self.static_map) + 1
+        self.x = max([len(s) for s in self.static_map] or [0])
+        self.coordinates = set()
+        self.goals = []  # so we may quickly check goal status later...
+
+        # the room gets the screen, less the status panel
+        self.height, self.width = renderer.size()
+        self.width -= STATUS_PANEL_WIDTH
+
+        # need a get_background command...
+        clear(0, 0, self.height, self.width, 1)
+
+        # good place for items that move about, rendered last (highest z index)
+        self.overlay_cells = {}
+
+        # bumped whenever a cell becomes passable or impassable, so
+        # enemies know when their cached paths have gone stale
+        self.version = 0
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+
+        # big rooms get a ClusterMap once they're drawn
+        self.cluster_map = None
+
+        # enemies are numbered as they're made, and take their turns
+        # by number and room.turn (see AIScheduler)
+        self.enemy_serials = itertools.count()
+        self.turn = 0
+
+    def next(self):
+        self.__init__(room=self.room)
+        self.draw()
+        player = room.player
 
     def goals_complete(self):
         goals_complete = 0
@@ -721,11 +1586,18 @@ class Room(object):
         entity.x = x
         entity.y = y
 
+        previous = self.overlay_cells.get((x, y))
+
+        if (previous is None or (previous.name in IMPASSABLE)
+                                != (entity.name in IMPASSABLE)):
+            self.version += 1
+
+            if self.cluster_map:
+                self.cluster_map.invalidate((x, y))
+
         self.overlay_cells[(x, y)] = entity
 
-        self.win.addch(y, x, entity.character,
-                       curses.color_pair(entity.color_pair))
-        self.win.refresh()
+        self.put_cell((x, y), entity)
 
     def __getitem__(self, key):
 
@@ -734,12 +1606,22 @@ class Room(object):
     def __delitem__(self, key):
 
         empty_space = EmptySpace()
+
+        if self.overlay_cells[key].name in IMPASSABLE:
+            self.version += 1
+
+            if self.cluster_map:
+                self.cluster_map.invalidate(key)
+
         self.overlay_cells[key] = empty_space
 
-        x, y = key
-        self.win.addch(y, x, empty_space.character,
-                       curses.color_pair(empty_space.color_pair))
-        self.win.refresh()
+        self.put_cell(key, empty_space)
+
+    def put_cell(self, plot, entity):
+        """Draw entity, which is at plot."""
+
+        x, y = plot
+        put(y, x, entity.character, entity.color_pair)
 
     def move(self, move_from, move_to):
         """Move an overlay cell by coordinate/key."""
@@ -759,27 +1641,27 @@ class Room(object):
 
         self[move_to] = source
 
-    def draw(self):
-        """Should be called compile... maybe a part of init?"""
+    def draw(self, background=True, flush=True):
+        """Should be called compile... maybe a part of init?
+
+        Args:
+          background (bool): draw the background too. Otherwise it's
+            left for tile_background().
+          flush (bool): get it onto the screen. Otherwise it's left for
+            the caller to flush along with whatever else it draws.
+
+        """
 
         # background lines
         # could draw this randomly for scatter pattern
         # background_cells = set()
+        if background:
 
-        for y, line in enumerate(self.background_lines):
-            line = line.strip().replace('\n', '')
-
-            for x, char in enumerate(line):
-                time.sleep(0.001)
-
-                try:
-                    self.win.addch(y, x, char)
-                except:
-
-                    break
+            for y, line in enumerate(self.background_lines):
+                put(y, 0, line, 1)
 
-                self.win.touchwin()
-                self.win.refresh()
+        # cells the map draws over, which the background stays out of
+        self.covered = covered = set()
 
         # collect data from "static map" and transform into entities
         for y, row in enumerate(self.static_map):
@@ -791,7 +1673,7 @@ class Room(object):
                     self[(x, y)] = self.player
 
                 elif col == '&':
-                    self[(x, y)] = Enemy()
+                    self[(x, y)] = Enemy(next(self.enemy_serials))
 
                 elif col == '#':
                     self[(x, y)] = Wall()
@@ -812,77 +1694,684 @@ class Room(object):
                 elif col == ';':
                     # new panel here?
                     comment = ''.join(row[x:])
-                    self.win.addstr(y, x, comment, curses.A_REVERSE
-                                                   | curses.A_BOLD)
+                    put(y, x, comment[:self.width - x],
+                        attr=curses.A_REVERSE | curses.A_BOLD)
+                    covered.update((x + i, y) for i in range(len(comment)))
 
                     break
 
-                self.coordinates.append((x, y))
+                self.coordinates.add((x, y))
 
         # now draw the overlay/entitites
         for coordinate, entity in self.overlay_cells.items():
             x, y = coordinate
-            self.win.addch(y, x, entity.character,
-                           curses.color_pair(entity.color_pair))
-
-        self.win.touchwin()
-        self.win.refresh()
-
-# runtime/start UI
-screen = curses.initscr()
-curses.noecho()
-curses.curs_set(0)
-curses.start_color()
-curses.use_default_colors()
-curses.cbreak()
-screen.keypad(1)
-
-# make the color combos here...
-colors = [
-           curses.COLOR_BLACK,
-           curses.COLOR_RED,
-           curses.COLOR_GREEN,
-           curses.COLOR_YELLOW,
-           curses.COLOR_BLUE,
-           curses.COLOR_MAGENTA,
-           curses.COLOR_CYAN,
-           curses.COLOR_WHITE,
-         ]
-random.shuffle(colors)
-all_color_combos = itertools.combinations(colors, 2)
-max_color_pair = 0
-
-for combo in all_color_combos:
-    max_color_pair += 1
-    curses.init_pair(max_color_pair, *combo)
-
-screen.bkgd(' ', curses.color_pair(1))
-screen.addstr(2, 2, 'PRESS M TO START', curses.color_pair(2))
-
-room = Room()
-room.draw()
-room.win.touchwin()
-
-player = room.player
-status = StatusPanel()
-
-while 1:
-
-    #screen.clear()
-    if player.update():
-
-        # check if all goals complete
-        if room.goals_complete():
-            room = Room(room.room + 1)
-            room.draw()
-            room.win.touchwin()
+            put(y, x, entity.character, entity.color_pair)
+
+        if len(self.coordinates) >= HPA_MIN_ROOM_AREA:
+            self.cluster_map = ClusterMap(self)
+
+        covered.update(self.overlay_cells)
+
+        if flush:
+            renderer.flush()
+
+    def tile_background(self):
+        """Tile the background in around an already drawn room, a row
+        at a time if the renderer's animated.
+
+        Never waits between rows, so it's done long before anybody can
+        press a key.
+
+        """
+
+        for y, line in enumerate(self.background_lines):
+
+            for x, char in enumerate(line):
+
+                if (x, y) in self.covered:
+
+                    continue
+
+                put(y, x, char, 1)
+
+            if renderer.animated:
+                renderer.flush()
+
+        renderer.flush()
+
+
+# WORLD #######################################################################
+
+
+class World(Room):
+
+    # map characters the world is paged in from (besides the player
+    # and enemies, see page_in())...
+    entities = {
+                '#': Wall,
+                '%': PlaceBlock,
+                '$': PushBlock,
+                '.': Goal,
+                ' ': EmptySpace,
+               }
+
+    # ...and paged back out to, by entity name
+    characters = {
+                  'enemy': '&',
+                  'wall': '#',
+                  'place block': '%',
+                  'push block': '$',
+                  'goal': '.',
+                  'empty': ' ',
+                 }
+
+    def __init__(self, chunk_size=WORLD_CHUNK_SIZE,
+                 radius=WORLD_CHUNK_RADIUS, max_chunks=WORLD_MAX_CHUNKS):
+        """Every room stitched together into one big map, only part of
+        which is ever in memory.
+
+        The map is cut up into square chunks. Those around the player
+        are paged in from the room files, entities, enemies and all,
+        as the player walks about (see follow()). Once too many are in,
+        the least recently used are paged out again. Chunks which
+        changed while they were in (blocks moved, place blocks picked
+        up or eaten) are serialized out to a temporary file on the way
+        out, so coming back to them finds them the way they were left
+        without them taking up memory in the meantime.
+
+        It's a Room as far as everything else is concerned; anywhere
+        that isn't paged in is a wall.
+
+        Args:
+          chunk_size (int): tiles across (and down) a chunk.
+          radius (int): chunks either side of the player's chunk to
+            keep paged in, at least 1 (the next chunk over has to be in
+            for the player to step into it).
+          max_chunks (int): most chunks paged in at once, at least the
+            chunks around the player.
+
+        Raises:
+          ValueError: if radius or max_chunks are too small.
+
+        """
+
+        if radius < 1:
+
+            raise ValueError('radius must be at least 1, not %d' % radius)
+
+        # pushing a block needs the tile two over to be in
+        if chunk_size * radius < 2:
+
+            raise ValueError('chunk_size * radius must be at least 2, not '
+                             '%d' % (chunk_size * radius))
+
+        if max_chunks < (2 * radius + 1) ** 2:
+
+            raise ValueError('max_chunks must be at least %d to fit the '
+                             'chunks around the player, not %d'
+                             % ((2 * radius + 1) ** 2, max_chunks))
+
+        # overlay_cells, coordinates and goals only ever have what's
+        # paged in
+        self.setup(None, 'WORLD')
+
+        self.chunk_size = chunk_size
+        self.radius = radius
+        self.max_chunks = max_chunks
+
+        # what's anywhere that isn't paged in
+        self.void = Wall()
+
+        self.chunks = collections.OrderedDict()  # chunk -> its plots
+        self.dirty = set()  # chunks changed since they were paged in
+        self.spill = tempfile.TemporaryFile()  # see page_out()
+        self.saved = {}  # chunk -> (offset, length) in self.spill
+        self.covered_goals = set()  # goals in saved chunks with blocks on
+        self.page_ins = 0
+        self.page_outs = 0
+
+        # world coordinates of the top left of the screen
+        self.left = 0
+        self.top = 0
+
+        self.rows = collections.OrderedDict()  # room # -> room_rows()
+        self.player = None
+        self.stitch()
+
+    def room_rows(self, room):
+        """The map of room # as rows of characters, comments cut off.
+
+        Only the map is read, not a whole RoomData, and the last
+        WORLD_ROOM_CACHE_SIZE rooms' are kept for paging in from.
+
+        """
+
+        rows = self.rows.pop(room, None)
+
+        if rows is None:
+
+            with open(data_path(get_manifest()[room]['filename'])) as f:
+                rows = [row.split(';', 1)[0].rstrip()
+                        for row in f.read().split('\n')][:-1]
+
+            while len(self.rows) >= WORLD_ROOM_CACHE_SIZE:
+                self.rows.popitem(last=False)
+
+        self.rows[room] = rows
+
+        return rows
+
+    def stitch(self):
+        """Lay the rooms out left to right.
+
+        Each room is knocked through into the one before it where both
+        have an outside wall with floor behind it, shifted up or down
+        for those walls to line up. Rooms which can't be joined that
+        way are just put alongside.
+
+        Only where each room goes is kept (self.placements); the maps
+        themselves are read back as chunks are paged in.
+
+        """
+
+        self.placements = []  # (room #, left, top, width, height)
+        self.doors = set()
+        self.all_goals = []
+        self.start = None
+
+        left = 0
+        previous = None  # (top, rows with a way out east) of the last
+
+        for room in sorted(get_manifest()):
+            rows = self.room_rows(room)
+            width = max(len(row) for row in rows)
+            exits = [y for y, row in enumerate(rows)
+                     if len(row) == width and row.endswith((' #', '.#'))]
+            entrances = [y for y, row in enumerate(rows)
+                         if row.startswith(('# ', '#.'))]
+            top = 0
+
+            if previous and previous[1] and entrances:
+                previous_top, previous_exits = previous
+                top = previous_top + previous_exits[0] - entrances[0]
+                self.doors.add((left - 1, top + entrances[0]))
+                self.doors.add((left, top + entrances[0]))
+
+            for y, row in enumerate(rows):
+
+                for x, character in enumerate(row):
+
+                    if character == '.':
+                        self.all_goals.append((left + x, top + y))
+
+                    elif character == '@' and self.start is None:
+                        self.start = (left + x, top + y)
+
+            self.placements.append((room, left, top, width, len(rows)))
+            previous = (top, exits)
+            left += width
+
+    def chunk_of(self, plot):
+
+        return plot[0] // self.chunk_size, plot[1] // self.chunk_size
+
+    def source_cells(self, chunk):
+        """[(plot, character), ...] of a chunk as the room files have it,
+        row by row. Anywhere outside the rooms is left out.
+
+        """
+
+        size = self.chunk_size
+        chunk_left = chunk[0] * size
+        chunk_top = chunk[1] * size
+        cells = []
+
+        for room, left, top, width, height in self.placements:
+
+            if (left >= chunk_left + size or left + width <= chunk_left
+                or top >= chunk_top + size or top + height <= chunk_top):
+
+                continue
+
+            rows = self.room_rows(room)
+
+            for y in range(max(top, chunk_top),
+                           min(top + height, chunk_top + size)):
+                row = rows[y - top]
+
+                for x in range(max(left, chunk_left),
+                               min(left + len(row), chunk_left + size)):
+                    character = row[x - left]
+
+                    # only the first room's player is the player
+                    if (x, y) in self.doors or (character == '@'
+                                                and (x, y) != self.start):
+                        character = ' '
+
+                    cells.append(((x, y), character))
+
+        cells.sort(key=lambda cell: (cell[0][1], cell[0][0]))
+
+        return cells
+
+    def page_in(self, chunk):
+        """Make the entities of a chunk, as it was last left."""
+
+        cells = self.source_cells(chunk)
+
+        if not cells:
+
+            return
+
+        saved = self.saved.get(chunk)
+
+        if saved is not None:
+            offset, length = saved
+            self.spill.seek(offset)
+            saved = self.spill.read(length).decode('ascii')
+
+        goals = set(self.all_goals)
+        plots = []
+
+        for i, (plot, character) in enumerate(cells):
+
+            if saved is not None:
+                character = saved[i]
+
+            if character == '@' and self.player is None:
+                entity = self.player = Player()
+            elif character == '&':
+                entity = Enemy(next(self.enemy_serials))
+            else:
+                entity = self.entities.get(character, EmptySpace)()
+
+            if plot in goals:
+                self.goals.append(plot)
+
+                if entity.name != 'goal':
+                    entity.underfoot = Goal()
+
+            entity.x, entity.y = plot
+            self.overlay_cells[plot] = entity
+            self.coordinates.add(plot)
+            self.put_cell(plot, entity)
+            plots.append(plot)
+
+        self.chunks[chunk] = plots
+        self.version += 1
+        self.page_ins += 1
+
+    def serialize(self, plots):
+        """The entities at plots as a string, a map character each.
+        Goals come back by themselves, so whatever's on one is enough.
+
+        """
+
+        characters = []
+
+        for plot in plots:
+            entity = self.overlay_cells[plot]
+
+            # the player isn't part of the map, only what's under them
+            if entity is self.player:
+                entity = entity.underfoot or EmptySpace()
+
+            characters.append(self.characters[entity.name])
+
+        return ''.join(characters)
+
+    def page_out(self, chunk):
+        """Drop the entities of a chunk, saving them if they changed."""
+
+        plots = self.chunks.pop(chunk)
+
+        if chunk in self.dirty:
+            self.dirty.discard(chunk)
+            serialized = self.serialize(plots).encode('ascii')
+            offset, length = self.saved.get(chunk, (None, None))
+
+            # a chunk's always the same size, so it's saved over itself
+            if length != len(serialized):
+                self.spill.seek(0, os.SEEK_END)
+                offset = self.spill.tell()
+
+            self.spill.seek(offset)
+            self.spill.write(serialized)
+            self.saved[chunk] = (offset, len(serialized))
+
+            for plot in self.goals:
+
+                if self.chunk_of(plot) != chunk:
+
+                    continue
+
+                if self.overlay_cells[plot].name == 'push block':
+                    self.covered_goals.add(plot)
+                else:
+                    self.covered_goals.discard(plot)
+
+        for plot in plots:
+            del self.overlay_cells[plot]
+            self.coordinates.discard(plot)
+            self.put_cell(plot, None)
+
+        self.goals = [goal for goal in self.goals
+                      if goal in self.coordinates]
+        self.version += 1
+        self.page_outs += 1
+
+    def follow(self, plot):
+        """Keep the chunks around plot paged in, and plot on the screen.
+
+        Args:
+          plot (tuple): (x, y) of the player.
+
+        """
+
+        chunk_x, chunk_y = self.chunk_of(plot)
+        radius = range(-self.radius, self.radius + 1)
+
+        for chunk in [(chunk_x + x, chunk_y + y) for y in radius
+                      for x in radius]:
+
+            # most recently used go to the end
+            if chunk in self.chunks:
+                self.chunks[chunk] = self.chunks.pop(chunk)
+            else:
+                self.page_in(chunk)
+
+        while len(self.chunks) > self.max_chunks:
+            self.page_out(next(iter(self.chunks)))
+
+        # scroll once the player gets near the edge of the screen
+        x = plot[0] - self.left
+        y = plot[1] - self.top
+        margin_x = self.width // 4
+        margin_y = self.height // 4
+
+        if (margin_x <= x < self.width - margin_x
+            and margin_y <= y < self.height - margin_y):
+
+            return
+
+        self.left = plot[0] - self.width // 2
+        self.top = plot[1] - self.height // 2
+
+        for y in range(self.height):
+            put(y, 0, ' ' * self.width, 1)
+
+        for cell, entity in self.overlay_cells.items():
+            self.put_cell(cell, entity)
+
+    def put_cell(self, plot, entity):
+        """Draw entity (None for nothing) if plot is on the screen."""
+
+        x = plot[0] - self.left
+        y = plot[1] - self.top
+
+        if not (0 <= x < self.width and 0 <= y < self.height):
+
+            return
+
+        if entity is None:
+            put(y, x, ' ', 1)
+        else:
+            put(y, x, entity.character, entity.color_pair)
+
+    def draw(self, background=True, flush=True):
+        """Page in and draw the world around where the player starts."""
+
+        self.covered = set()
+
+        # off the screen, so follow() has to scroll to it
+        self.left = self.start[0] - self.width
+        self.follow(self.start)
+
+        if flush:
+            renderer.flush()
+
+    def goals_complete(self):
+
+        elsewhere = []
+
+        for goal in self.all_goals:
+            entity = self.overlay_cells.get(goal)
+
+            if entity is None:
+                elsewhere.append(goal)
+
+            elif entity.name != 'push block':
+
+                return False
+
+        # as they were left when they were paged out
+        return all(goal in self.covered_goals for goal in elsewhere)
+
+    def __setitem__(self, key, value):
+        Room.__setitem__(self, key, value)
+        self.dirty.add(self.chunk_of(key))
+
+    def __getitem__(self, key):
+
+        return self.overlay_cells.get(key, self.void)
+
+    def __delitem__(self, key):
+        Room.__delitem__(self, key)
+        self.dirty.add(self.chunk_of(key))
+
+# Runtime/start UI ###########################################################
+
+
+def make_palette(count=COLOR_PAIRS):
+    """Pair up the colors at random, for as many color pairs as are used.
+
+    Returns:
+      dict: curses color pair # -> (foreground, background).
+
+    """
+
+    # make the color combos here...
+    colors = [
+               curses.COLOR_BLACK,
+               curses.COLOR_RED,
+               curses.COLOR_GREEN,
+               curses.COLOR_YELLOW,
+               curses.COLOR_BLUE,
+               curses.COLOR_MAGENTA,
+               curses.COLOR_CYAN,
+               curses.COLOR_WHITE,
+             ]
+    random.shuffle(colors)
+    all_color_combos = itertools.combinations(colors, 2)
+
+    return dict(enumerate(itertools.islice(all_color_combos, count), 1))
+
+
+def report(stream, path_cache_hits, path_cache_misses):
+    """Write the enemy AI's numbers out, for tuning AI_UPDATE_BUCKETS.
+
+    Args:
+      stream (file): where to write them.
+      path_cache_hits (int): Enemy.find_path() reuses, every room.
+      path_cache_misses (int): Enemy.find_path() searches, every room.
+
+    """
+
+    for name, limit, interval in scheduler.buckets:
+        stats = scheduler.stats[name]
+        stream.write('%-4s  updates %6d  skips %6d  %8.3f ms/update\n'
+                     % (name, stats['updates'], stats['skips'],
+                        1000 * stats['seconds'] / max(stats['updates'], 1)))
+
+    lookups = path_cache_hits + path_cache_misses
+    stream.write('path cache: %d/%d hits (%.0f%%)\n'
+                 % (path_cache_hits, lookups,
+                    100.0 * path_cache_hits / max(lookups, 1)))
+
+
+def main():
+    """Run the game."""
+
+    global renderer, recorder, loader, scheduler, hint_engine, room, player
+    global status
+
+    # only the game itself needs this, tools importing us shouldn't
+    # have to pay for it
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sokool: Sokoban Kool '
+                                                 'Edition')
+    parser.add_argument('--record', metavar='FILE',
+                        help='record the session as asciicast v2 to a file or '
+                             'named pipe (play it back with recording.py)')
+    parser.add_argument('--renderer', choices=('curses', 'ansi'),
+                        default='curses', help='screen backend to draw with')
+    parser.add_argument('--output', metavar='FILE',
+                        help='with --renderer ansi, draw into FILE instead of '
+                             'the terminal (headless)')
+    parser.add_argument('--world', action='store_true',
+                        help='play every room stitched into one open world')
+    parser.add_argument('--world-chunks', metavar='N', type=int,
+                        default=WORLD_MAX_CHUNKS,
+                        help='with --world, most chunks of %d by %d tiles to '
+                             'keep in memory'
+                             % (WORLD_CHUNK_SIZE, WORLD_CHUNK_SIZE))
+    parser.add_argument('--stats', action='store_true',
+                        help='on exit, print how long enemies spent thinking '
+                             'and how often their paths were reused')
+    args = parser.parse_args()
+
+    if args.world_chunks < (2 * WORLD_CHUNK_RADIUS + 1) ** 2:
+        parser.error('--world-chunks must be at least %d, the chunks around '
+                     'the player' % (2 * WORLD_CHUNK_RADIUS + 1) ** 2)
+
+    palette = make_palette()
+
+    # for --stats, from the rooms already left behind
+    path_cache_hits = 0
+    path_cache_misses = 0
+
+    # with --output, the file the ansi renderer draws into
+    output = None
+
+    # setting up is inside the try too, so the terminal is put back the
+    # way it was whatever goes wrong (a --record path that can't be
+    # opened, a broken room file...)
+    try:
+
+        if args.renderer == 'ansi':
+            output = open(args.output, 'w') if args.output else None
+            renderer = renderers.AnsiRenderer(palette, output=output)
+        else:
+            renderer = renderers.CursesRenderer(palette)
+
+        if args.record:
+            screen_height, screen_width = renderer.size()
+            recorder = recording.Recorder(args.record, screen_width,
+                                          screen_height, palette)
+
+        loader = RoomLoader(renderer.size())
+        scheduler = AIScheduler()
+
+        if args.world:
+            room = World(max_chunks=args.world_chunks)
+            room.draw(flush=False)
             player = room.player
+            status = StatusPanel()
+            renderer.flush()
 
-            continue
+        else:
+            # first frame as soon as possible, then the background tiles
+            # in
+            room = Room()
+            room.draw(background=False, flush=False)
+            player = room.player
+            status = StatusPanel()
+            renderer.flush()
+
+            loader.prefetch(room.room + 1)
+            room.tile_background()
+
+            # starts thinking about hints right away, so there's one
+            # ready by the time anybody asks
+            hint_engine = hints.HintEngine()
+            hint_engine.start()
+            level = hints.level_of(room, player)
+            hint_engine.update(level, hints.state_of(room, player))
+
+        if recorder:
+            recorder.end_turn()
+
+        while 1:
+
+            #screen.clear()
+            if player.update():
+
+                if args.world:
+                    room.follow((player.x, player.y))
+
+                # check if all goals complete
+                if room.goals_complete():
+
+                    # that was every room there is
+                    if args.world:
+
+                        break
+
+                    path_cache_hits += room.path_cache_hits
+                    path_cache_misses += room.path_cache_misses
+                    room = Room(room.room + 1)
+
+                    # one flush, once the status panel's up too
+                    room.draw(flush=False)
+                    loader.prefetch(room.room + 1)
+                    player = room.player
+                    status = StatusPanel()
+                    renderer.flush()
+                    level = hints.level_of(room, player)
+                    hint_engine.update(level, hints.state_of(room, player))
+
+                    if recorder:
+                        recorder.end_turn()
+
+                    continue
+
+                # all entities move after player!
+                scheduler.update(room)
+
+                if hint_engine:
+                    hint_engine.update(level, hints.state_of(room, player))
+
+                if status.hint:
+                    status.show_hint(None)
+
+                renderer.flush()
+
+                if recorder:
+                    recorder.end_turn()
+
+    # ran out of key presses (headless)
+    except EOFError:
+        pass
+
+    finally:
+
+        if renderer:
+            renderer.close()
+
+        if output:
+            output.close()
+
+        if args.stats and scheduler and room:
+            report(sys.stderr, path_cache_hits + room.path_cache_hits,
+                   path_cache_misses + room.path_cache_misses)
+
+        if hint_engine:
+            hint_engine.stop()
 
-        # all entities move after player!
-        for entity in room:
+        if recorder:
+            recorder.close()
 
-            if entity.name == 'enemy':
-                entity.update()
 
+if __name__ == '__main__':
+    main()